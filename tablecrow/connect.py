@@ -67,7 +67,7 @@ def connect(
         database_types.remove("SQLite")
 
     for credential in credentials:
-        if credential in kwargs and kwargs[credential] is not None:
+        if kwargs.get(credential) is not None:
             credentials[credential] = kwargs[credential]
 
     for current_database_type in database_types:
@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+from datetime import date, datetime
 import logging
 from logging import Logger
 from pathlib import Path
@@ -217,12 +218,25 @@ class DatabaseTable(ABC):
 
         raise NotImplementedError
 
+    def records_where_many(
+        self, wheres: List[Union[Mapping[str, Any], str, List[str]]]
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        lists of records in the table that match each of the given queries
+
+        :param wheres: queries, each of which is accepted by ``records_where``
+        :return: dictionaries of matching records, for each query
+        """
+
+        return [self.records_where(where) for where in wheres]
+
     @abstractmethod
-    def insert(self, records: List[Dict[str, Any]]):
+    def insert(self, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """
-        insert the list of records into the table
+        insert the list of records into the table, updating any existing records with the same primary key
 
         :param records: dictionary records
+        :return: records as stored in the table after insertion, one for each of the given records
         """
 
         raise NotImplementedError
@@ -260,24 +274,23 @@ class DatabaseTable(ABC):
                 )
             where = {field: key[index] for index, field in enumerate(self.primary_key)}
 
-        if not self.connected:
-            raise ConnectionError(
-                f"no connection to {self.username}@{self.resource}:{self.port}/{self.database}/{self.name}"
-            )
-
         try:
             records = self.records_where(where)
+        except Exception as error:
+            if not self.connected:
+                raise ConnectionError(
+                    f"no connection to {self.username}@{self.resource}:{self.port}/{self.database}/{self.name}"
+                ) from error
+            raise KeyError(f'no record with primary key "{key}"') from error
+
+        if len(records) > 1:
+            self.logger.warning(
+                f"found more than one record matching query {where}: {records}"
+            )
 
-            if len(records) > 1:
-                self.logger.warning(
-                    f"found more than one record matching query {where}: {records}"
-                )
-
-            if len(records) > 0:
-                return records[0]
-            else:
-                raise KeyError(f'no record with primary key "{key}"')
-        except:
+        if len(records) > 0:
+            return records[0]
+        else:
             raise KeyError(f'no record with primary key "{key}"')
 
     def __setitem__(self, key: Any, record: Dict[str, Any]):
@@ -300,12 +313,14 @@ class DatabaseTable(ABC):
         for key_index, primary_key in enumerate(self.primary_key):
             record[primary_key] = key[key_index]
 
-        if not self.connected:
-            raise ConnectionError(
-                f"no connection to {self.username}@{self.resource}:{self.port}/{self.database}/{self.name}"
-            )
-
-        self.insert([record])
+        try:
+            self.insert([record])
+        except Exception as error:
+            if not self.connected:
+                raise ConnectionError(
+                    f"no connection to {self.username}@{self.resource}:{self.port}/{self.database}/{self.name}"
+                ) from error
+            raise
 
     def __delitem__(self, key: Any):
         """
@@ -329,25 +344,19 @@ class DatabaseTable(ABC):
                 )
             where = {field: key[index] for index, field in enumerate(self.primary_key)}
 
-        if not self.connected:
-            raise ConnectionError(
-                f"no connection to {self.username}@{self.resource}:{self.port}/{self.database}/{self.name}"
-            )
-
         try:
             self.delete_where(where)
-        except:
-            raise KeyError(f'no record with primary key "{key}"')
+        except Exception as error:
+            if not self.connected:
+                raise ConnectionError(
+                    f"no connection to {self.username}@{self.resource}:{self.port}/{self.database}/{self.name}"
+                ) from error
+            raise KeyError(f'no record with primary key "{key}"') from error
 
     def __len__(self) -> int:
         return len(self.records)
 
     def __contains__(self, key: Any) -> bool:
-        if not self.connected:
-            raise ConnectionError(
-                f"no connection to {self.username}@{self.resource}:{self.port}/{self.database}/{self.name}"
-            )
-
         try:
             self[key]
             return True
@@ -531,5 +540,18 @@ def parse_record_values(
     for field, value in record.items():
         if field in field_types:
             field_type = field_types[field]
+            # values that are empty, or already of the field type, need no conversion
+            # (field types given as collections, such as `[str]`, turn empty values into empty collections)
+            if isinstance(field_type, type) and (
+                value is None or type(value) is field_type
+            ):
+                continue
+            # dates and times are read back as ISO 8601 strings, which can be parsed without guessing the format
+            if isinstance(value, str) and field_type in (datetime, date):
+                try:
+                    record[field] = field_type.fromisoformat(value)
+                    continue
+                except ValueError:
+                    pass
             record[field] = to_type(value, field_type)
     return record
@@ -1,28 +1,48 @@
-from datetime import date, datetime
+import atexit
+from contextlib import contextmanager
+from datetime import date, datetime, time
+from io import StringIO
 from functools import partial
 from getpass import getpass
+from hashlib import sha256
+from itertools import count
 from logging import Logger
+import re
 from sqlite3 import Cursor
-from typing import Any, Collection, Dict
-from typing import List, Mapping, Sequence, Union
+from typing import Any, Collection, Dict, Generator
+from typing import List, Mapping, Sequence, Tuple, Union
 from typing import get_args as typing_get_args
+from uuid import uuid4
+from weakref import WeakKeyDictionary
 
 import psycopg2
 from psycopg2._psycopg import connection
+from psycopg2.extras import execute_values, RealDictCursor
+from psycopg2.pool import PoolError, ThreadedConnectionPool
 from pyproj import CRS
 from shapely.geometry.base import BaseGeometry, BaseMultipartGeometry, GEOMETRY_TYPES
 from sshtunnel import SSHTunnelForwarder
 from typepigeon import subscripted_type
 
-from tablecrow.tables.base import (
-    DatabaseTable,
-    parse_record_values,
-    random_open_tcp_port,
-)
+from tablecrow.tables.base import DatabaseTable, parse_record_values
 
-from tablecrow.utilities import parse_hostname, split_hostname_port
+from tablecrow.utilities import parse_hostname
 
 SSH_DEFAULT_PORT = 22
+CONNECTION_POOL_SIZE = 10
+# idle connections beyond this number are closed when they are returned to the pool
+CONNECTION_POOL_MINIMUM_SIZE = 1
+INSERT_PAGE_SIZE = 1000
+PREPARED_STATEMENT_CACHE_SIZE = 32
+# batches at least this large are loaded with COPY instead of INSERT
+COPY_THRESHOLD = 100
+# types that can be written directly in COPY's text format
+COPY_TYPES = (type(None), bool, int, float, str, bytes, date, time)
+
+# connection pools, along with the SSH tunnels they connect through, by a hash of their credentials
+CONNECTION_POOLS: Dict[str, Tuple[ThreadedConnectionPool, SSHTunnelForwarder]] = {}
+# names of the statements prepared on each connection, by query
+PREPARED_STATEMENTS = WeakKeyDictionary()
 
 
 class PostGresTable(DatabaseTable):
@@ -58,15 +78,21 @@ class PostGresTable(DatabaseTable):
     ):
         self.tunnel_credentials = {}
 
-        if "ssh_hostname" in kwargs and kwargs["ssh_hostname"] is not None:
+        if kwargs.get("ssh_hostname") is not None:
             credentials = parse_hostname(kwargs["ssh_hostname"])
             ssh_hostname = credentials["hostname"]
             ssh_port = credentials["port"]
             if ssh_port is None:
                 ssh_port = SSH_DEFAULT_PORT
 
-            ssh_username = kwargs["ssh_username"] if "ssh_username" in kwargs else None
-            ssh_password = kwargs["ssh_password"] if "ssh_password" in kwargs else None
+            ssh_username = kwargs.get("ssh_username")
+            if ssh_username is None:
+                ssh_username = credentials["username"]
+            ssh_password = kwargs.get("ssh_password")
+            if ssh_password is None:
+                ssh_password = credentials["password"]
+            if ssh_username is not None and ":" in ssh_username:
+                ssh_username, ssh_password = ssh_username.split(":", 1)
 
             self.tunnel_credentials["ssh_hostname"] = ssh_hostname
             self.tunnel_credentials["ssh_port"] = ssh_port
@@ -103,107 +129,18 @@ class PostGresTable(DatabaseTable):
                 f"no connection to {self.username}@{self.hostname}:{self.port}/{self.database}/{self.name}"
             )
 
-        if self.fields is None:
-            with self.connection as connection:
-                with connection.cursor() as cursor:
+        with self.__connect() as connection:
+            with connection.cursor() as cursor:
+                if self._DatabaseTable__fields is None:
                     self._DatabaseTable__fields = database_table_fields(
                         cursor, self.name
                     )
-            connection.close()
-
-            if self.primary_key is None:
-                self._DatabaseTable__primary_key = list(self.fields)[0]
-
-        with self.connection as connection:
-            with connection.cursor() as cursor:
-                if database_has_table(cursor, self.name):
-                    if database_table_is_inherited(cursor, self.name):
-                        raise RuntimeError(
-                            f'inheritance of table "{self.database}/{self.name}" will cause unexpected behaviour; aborting'
-                        )
-
-                    remote_fields = self.remote_fields
-                    if list(remote_fields) != list(self.fields):
-                        self.logger.warning(
-                            f'schema of existing table "{self.database}/{self.name}" differs from given fields'
-                        )
-
-                        remote_fields_not_in_local_table = {
-                            field: value
-                            for field, value in remote_fields.items()
-                            if field not in self.fields
-                        }
-                        if len(remote_fields_not_in_local_table) > 0:
-                            self.logger.warning(
-                                f"remote table has {len(remote_fields_not_in_local_table)} fields not in local table: {list(remote_fields_not_in_local_table)}"
-                            )
-                            self.logger.warning(
-                                f"adding {len(remote_fields_not_in_local_table)} fields to local table: {list(remote_fields_not_in_local_table)}"
-                            )
-
-                            self._DatabaseTable__fields.update(
-                                remote_fields_not_in_local_table
-                            )
-                            self._DatabaseTable__fields = {
-                                field: self._DatabaseTable__fields[field]
-                                for field in remote_fields
-                            }
-
-                        local_fields_not_in_remote_table = {
-                            field: value
-                            for field, value in self.fields.items()
-                            if field not in remote_fields
-                        }
-                        if len(local_fields_not_in_remote_table) > 0:
-                            self.logger.warning(
-                                f"local table has {len(local_fields_not_in_remote_table)} fields not in remote table: {list(local_fields_not_in_remote_table)}"
-                            )
-                            self.logger.warning(
-                                f"adding {len(local_fields_not_in_remote_table)} fields to remote table: {list(local_fields_not_in_remote_table)}"
-                            )
-
-                        if list(remote_fields) != list(self.fields):
-                            self.logger.warning(
-                                f'altering schema of "{self.database}/{self.name}"'
-                            )
-                            self.logger.debug(self.remote_fields)
-                            self.logger.debug(self.fields)
-
-                            copy_table_name = f"old_{self.name}"
-
-                            if database_has_table(cursor, copy_table_name):
-                                cursor.execute(f"DROP TABLE {copy_table_name};")
-
-                            cursor.execute(
-                                f"ALTER TABLE {self.name} RENAME TO {copy_table_name};"
-                            )
-
-                            cursor.execute(f"CREATE TABLE {self.name} ({self.schema});")
-                            for user in self.users:
-                                cursor.execute(
-                                    f"GRANT INSERT, SELECT, UPDATE, DELETE ON TABLE public.{self.name} TO {user};"
-                                )
-
-                            copy_table_fields = list(
-                                database_table_fields(cursor, copy_table_name)
-                            )
 
-                            cursor.execute(
-                                f'INSERT INTO {self.name} ({", ".join(copy_table_fields)}) SELECT {", ".join(copy_table_fields)} FROM {copy_table_name};'
-                            )
+                    if self.primary_key is None:
+                        self._DatabaseTable__primary_key = list(self.fields)[0]
 
-                            cursor.execute(f"DROP TABLE {copy_table_name};")
-                else:
-                    self.logger.debug(
-                        f'creating remote table "{self.database}/{self.name}"'
-                    )
-                    cursor.execute(f"CREATE TABLE {self.name} ({self.schema});")
+                self.__sync_schema(cursor)
 
-                    for user in self.users:
-                        cursor.execute(
-                            f"GRANT INSERT, SELECT, UPDATE, DELETE ON TABLE public.{self.name} TO {user};"
-                        )
-        connection.close()
         if "password" in kwargs:
             kwargs["password"] = "*****"
         self.kwargs = kwargs
@@ -215,9 +152,6 @@ class PostGresTable(DatabaseTable):
     @property
     def tunnel(self) -> SSHTunnelForwarder:
         if "ssh_hostname" in self.tunnel_credentials:
-            port = split_hostname_port(self.resource)[-1]
-            if port is None:
-                port = self.DEFAULT_PORT
             tunnel = SSHTunnelForwarder(
                 (
                     self.tunnel_credentials["ssh_hostname"],
@@ -225,8 +159,9 @@ class PostGresTable(DatabaseTable):
                 ),
                 ssh_username=self.tunnel_credentials["ssh_username"],
                 ssh_password=self.tunnel_credentials["ssh_password"],
-                remote_bind_address=("localhost", port),
-                local_bind_address=("localhost", random_open_tcp_port()),
+                remote_bind_address=("localhost", self.port),
+                # let the operating system assign a free port when the tunnel binds
+                local_bind_address=("localhost", 0),
             )
             try:
                 tunnel.start()
@@ -257,138 +192,138 @@ class PostGresTable(DatabaseTable):
 
     @property
     def exists(self) -> bool:
-        with self.connection as connection:
+        with self.__connect() as connection:
             with connection.cursor() as cursor:
                 exists = database_has_table(cursor, self.name)
-        connection.close()
         return exists
 
     @property
     def schema(self) -> str:
         """PostGres schema string"""
 
-        schema = []
-        for field, field_type in self.fields.items():
-            field_type = subscripted_type(field_type)
-
-            if field_type in [list, tuple, Sequence, Collection]:
-                field_type = [typing_get_args(field_type[0])]
-            dimensions = 0
-            while isinstance(field_type, Sequence) and not isinstance(field_type, str):
-                if len(field_type) > 0:
-                    field_type = field_type[0]
-                else:
-                    field_type = list
-                dimensions += 1
-            if isinstance(field_type, Mapping):
-                field_type = dict
-
-            try:
-                field_type = self.FIELD_TYPES[field_type.__name__]
-            except KeyError:
-                raise TypeError(f'PostGres does not support type "{field_type}"')
-
-            schema.append(f'{field} {field_type}{"[]" * dimensions}')
-
+        schema = [
+            self.__field_schema(field, field_type)
+            for field, field_type in self.fields.items()
+        ]
         schema.append(f'PRIMARY KEY({", ".join(self.primary_key)})')
 
         return ", ".join(schema)
 
     @property
     def remote_fields(self) -> Dict[str, type]:
-        if not self.connected:
-            raise ConnectionError(
-                f"no connection to {self.username}@{self.hostname}:{self.port}/{self.database}/{self.name}"
-            )
-
-        fields = None
-        with self.connection as connection:
+        with self.__connect() as connection:
             with connection.cursor() as cursor:
-                if database_has_table(cursor, self.name):
-                    fields = database_table_fields(cursor, self.name)
-
-                    for field, field_type in fields.items():
-                        dimensions = field_type.count("_")
-                        field_type = field_type.strip("_")
-
-                        field_type = field_type.lower()
-                        if field_type == "geometry":
-                            if field in self.fields:
-                                fields[field] = self.fields[field]
-                                continue
-
-                        for python_type, postgres_type in self.FIELD_TYPES.items():
-                            if postgres_type.lower() == field_type:
-                                if field_type == "geometry":
-                                    if python_type not in globals():
-                                        exec(
-                                            f"from shapely.geometry import {python_type}"
-                                        )
-                                field_type = eval(python_type)
-                                break
-                        else:
-                            for python_type, postgres_type in self.FIELD_TYPES.items():
-                                if python_type.lower() in field_type:
-                                    field_type = eval(python_type)
-                                    break
-                            else:
-                                field_type = str
+                exists, fields = database_table_probe(cursor, self.name)
+        return self.__parse_remote_fields(fields) if exists else None
 
-                        for _ in range(dimensions):
-                            field_type = [field_type]
-                        fields[field] = field_type
-                else:
-                    fields = None
-        connection.close()
+    @property
+    def connection_pool(self) -> ThreadedConnectionPool:
+        """pool of connections shared between tables with the same credentials"""
 
-        return fields
+        # avoid keeping the password in plain text
+        key = sha256(
+            repr(
+                (
+                    self.hostname,
+                    self.port,
+                    self.database,
+                    self.username,
+                    self._DatabaseTable__password,
+                    *self.tunnel_credentials.values(),
+                )
+            ).encode()
+        ).hexdigest()
+        if key not in CONNECTION_POOLS or CONNECTION_POOLS[key][0].closed:
+            if key in CONNECTION_POOLS and CONNECTION_POOLS[key][1] is not None:
+                CONNECTION_POOLS[key][1].stop()
+
+            # the tunnel must stay open for as long as its pool exists
+            tunnel = self.tunnel
+            if tunnel is not None:
+                hostname, port = tunnel.local_bind_host, tunnel.local_bind_port
+            else:
+                hostname, port = self.hostname, self.port
+            try:
+                pool = ThreadedConnectionPool(
+                    minconn=CONNECTION_POOL_MINIMUM_SIZE,
+                    maxconn=CONNECTION_POOL_SIZE,
+                    host=hostname,
+                    port=port,
+                    database=self.database,
+                    user=self.username,
+                    password=self._DatabaseTable__password,
+                )
+            except:
+                if tunnel is not None:
+                    tunnel.stop()
+                raise
+            CONNECTION_POOLS[key] = (pool, tunnel)
+        return CONNECTION_POOLS[key][0]
 
     @property
     def connected(self) -> bool:
-        with self.connection as connection:
-            try:
+        try:
+            with self.__connect() as connection:
                 with connection.cursor() as cursor:
                     cursor.execute("SELECT 1;")
                     cursor.fetchone()
-                connected = True
-            except:
-                connected = False
-        connection.close()
+            connected = True
+        except:
+            connected = False
         return connected
 
     def records_where(
         self, where: Union[Mapping[str, Any], str, List[str]]
     ) -> List[Dict[str, Any]]:
-        if not self.connected:
-            raise ConnectionError(
-                f"no connection to {self.username}@{self.hostname}:{self.port}/{self.database}/{self.name}"
+        where_clause, where_values = self.__where_clause(where)
+
+        if where_clause is None:
+            matching_records = list(
+                self.__select(
+                    f'SELECT {", ".join(self.fields.keys())} FROM {self.name};'
+                )
             )
+        else:
+            query = f'SELECT {", ".join(self.fields.keys())} FROM {self.name} WHERE {where_clause};'
+            try:
+                if where_values is not None:
+                    matching_records = self.__select_prepared(query, where_values)
+                else:
+                    matching_records = list(self.__select(query))
+            except psycopg2.errors.UndefinedColumn as error:
+                raise KeyError(error)
+            except psycopg2.errors.SyntaxError as error:
+                raise SyntaxError(f"invalid SQL syntax - {error}")
 
-        where_clause, where_values = self.__where_clause(where)
+        return matching_records
 
-        with self.connection as connection:
-            with connection.cursor() as cursor:
-                if where_clause is None:
-                    cursor.execute(
-                        f'SELECT {", ".join(self.fields.keys())} FROM {self.name};'
-                    )
+    def records_where_many(
+        self, wheres: List[Union[Mapping[str, Any], str, List[str]]]
+    ) -> List[List[Dict[str, Any]]]:
+        # combine the queries into a single statement, labelling each record with the index of the query it matched
+        queries = []
+        values = []
+        for index, where in enumerate(wheres):
+            where_clause, where_values = self.__where_clause(where)
+            query = f'SELECT {index} AS tablecrow_query, {", ".join(self.fields.keys())} FROM {self.name}'
+            if where_clause is not None:
+                if where_values is None:
+                    # escape literal percent signs, since the combined statement is given parameters
+                    where_clause = where_clause.replace("%", "%%")
                 else:
-                    try:
-                        cursor.execute(
-                            f"SELECT * FROM {self.name} WHERE {where_clause};",
-                            where_values,
-                        )
-                    except psycopg2.errors.UndefinedColumn as error:
-                        raise KeyError(error)
-                    except psycopg2.errors.SyntaxError as error:
-                        raise SyntaxError(f"invalid SQL syntax - {error}")
-                matching_records = cursor.fetchall()
-        connection.close()
+                    values.extend(where_values)
+                query += f" WHERE {where_clause}"
+            queries.append(f"({query})")
 
-        matching_records = [
-            parse_record_values(dict(zip(self.fields.keys(), record)), self.fields)
-            for record in matching_records
-        ]
+        matching_records = [[] for _ in wheres]
+        if len(queries) > 0:
+            try:
+                for record in self.__select(f'{" UNION ALL ".join(queries)};', values):
+                    matching_records[record.pop("tablecrow_query")].append(record)
+            except psycopg2.errors.UndefinedColumn as error:
+                raise KeyError(error)
+            except psycopg2.errors.SyntaxError as error:
+                raise SyntaxError(f"invalid SQL syntax - {error}")
 
         return matching_records
 
@@ -404,31 +339,27 @@ class PostGresTable(DatabaseTable):
         if geometry_fields is None or len(geometry_fields) == 0:
             geometry_fields = list(self.geometry_fields)
 
+        geometry_values = [psycopg2.Binary(geometry.wkb), crs.to_epsg()]
+        geometry_string = "ST_GeomFromWKB(%s, %s)"
+        if crs != self.crs:
+            geometry_string = f"ST_Transform({geometry_string}, %s)"
+            geometry_values.append(self.crs.to_epsg())
+
+        # `ST_Intersects` already includes a bounding box (`&&`) comparison that uses the GIST index of each field
         where_clause = []
         where_values = []
         for field in geometry_fields:
-            where_values.extend([geometry.wkt, crs.to_epsg()])
-            geometry_string = "ST_GeomFromText(%s, %s)"
-            if crs != self.crs:
-                geometry_string = f"ST_Transform({geometry_string}, %s)"
-                where_values.append(self.crs.to_epsg())
+            where_values.extend(geometry_values)
             where_clause.append(f"ST_Intersects({field}, {geometry_string})")
         where_clause = " OR ".join(where_clause)
 
-        with self.connection as connection:
-            with connection.cursor() as cursor:
-                cursor.execute(
-                    f"SELECT * FROM {self.name} WHERE {where_clause};", where_values
-                )
-                records = cursor.fetchall()
-        connection.close()
-
-        return [
-            parse_record_values(dict(zip(self.fields.keys(), record)), self.fields)
-            for record in records
-        ]
+        return list(
+            self.__select(
+                f"SELECT * FROM {self.name} WHERE {where_clause};", where_values
+            )
+        )
 
-    def insert(self, records: List[Dict[str, Any]]):
+    def insert(self, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         if isinstance(records, dict):
             records = [records]
 
@@ -437,111 +368,140 @@ class PostGresTable(DatabaseTable):
                 f'one or more records does not contain primary key(s) "{self.primary_key}"'
             )
 
-        if not self.connected:
-            raise ConnectionError(
-                f"no connection to {self.username}@{self.hostname}:{self.port}/{self.database}/{self.name}"
-            )
+        fields = self.fields
+        primary_key = self.primary_key
+        geometry_fields = self.geometry_fields
+        srid = self.crs.to_epsg() if len(geometry_fields) > 0 else None
+
+        # group consecutive records with the same columns, so that each group is upserted by a single statement
+        batches = []
+        batch_keys = set()
+        for record in records:
+            record_fields_not_in_local_table = [
+                field for field in record if field not in fields
+            ]
+            if len(record_fields_not_in_local_table) > 0:
+                self.logger.warning(
+                    f"record has {len(record_fields_not_in_local_table)} fields not in the local table"
+                    f" that will not be inserted: {record_fields_not_in_local_table}"
+                )
 
-        with self.connection as connection:
-            with connection.cursor() as cursor:
-                for record in records:
-                    if len(self.primary_key) == 1:
-                        primary_key_string = self.primary_key[0]
-                        primary_key_value = record[self.primary_key[0]]
+            # map each column to the value to store in it
+            columns = {}
+            for field in fields:
+                if field not in record:
+                    continue
+                value = record[field]
+                if field in geometry_fields:
+                    # skip empty geometries, so that existing geometries are not overwritten
+                    if value is None:
+                        continue
+                    value = value.wkb
+                elif isinstance(value, Collection) and not isinstance(
+                    value, (str, list)
+                ):
+                    value = list(value)
+                columns[field] = value
+
+            # a single statement cannot upsert the same row twice
+            primary_key_value = tuple(record[field] for field in primary_key)
+            if (
+                len(batches) == 0
+                or list(columns) != batches[-1][0]
+                or primary_key_value in batch_keys
+            ):
+                batches.append((list(columns), []))
+                batch_keys = set()
+            batch_keys.add(primary_key_value)
+            batches[-1][1].append(tuple(columns.values()))
+
+        inserted_records = []
+        with self.__connect() as connection:
+            with connection.cursor(cursor_factory=RealDictCursor) as cursor:
+                for columns, rows in batches:
+                    update_columns = [
+                        column for column in columns if column not in primary_key
+                    ]
+                    if len(update_columns) > 0:
+                        on_conflict = f'DO UPDATE SET {", ".join(f"{column} = EXCLUDED.{column}" for column in update_columns)}'
                     else:
-                        primary_key_string = f'({", ".join(self.primary_key)})'
-                        primary_key_value = tuple(
-                            record[primary_key] for primary_key in self.primary_key
-                        )
+                        # a no-op update, so that existing records are still returned
+                        on_conflict = f"DO UPDATE SET {primary_key[0]} = EXCLUDED.{primary_key[0]}"
+                    on_conflict = (
+                        f'ON CONFLICT ({", ".join(primary_key)}) {on_conflict}'
+                    )
 
-                    record_fields_not_in_local_table = [
-                        field for field in record if field not in self.fields
-                    ]
-                    if len(record_fields_not_in_local_table) > 0:
-                        self.logger.warning(
-                            f"record has {len(record_fields_not_in_local_table)} fields not in the local table"
-                            f" that will not be inserted: {record_fields_not_in_local_table}"
+                    if not self.__has_unique_key:
+                        inserted_records.extend(
+                            self.__upsert_rows(cursor, columns, rows, srid)
                         )
-
-                    local_fields_in_record = [
-                        field for field in self.fields if field in record
-                    ]
-                    geometry_fields = [
-                        field for field in self.geometry_fields if field in record
-                    ]
-
-                    columns = [
-                        field
-                        for field in local_fields_in_record
-                        if field not in geometry_fields
-                    ]
-                    values = [
-                        record[field]
-                        for field in local_fields_in_record
-                        if field not in geometry_fields
-                    ]
-
-                    for index, value in enumerate(values):
-                        if isinstance(value, Collection) and not isinstance(
-                            value, (str, list)
-                        ):
-                            values[index] = list(value)
-
-                    if primary_key_value in self:
-                        record_without_primary_key = {
-                            column: value
-                            for column, value in zip(columns, values)
-                            if column not in self.primary_key
-                        }
-                        if len(record_without_primary_key) > 0:
-                            if len(record_without_primary_key) > 1:
-                                cursor.execute(
-                                    f'UPDATE {self.name} SET ({", ".join(record_without_primary_key.keys())}) = %s '
-                                    f"WHERE {primary_key_string} = %s;",
-                                    [
-                                        tuple(record_without_primary_key.values()),
-                                        primary_key_value,
-                                    ],
-                                )
-                            else:
-                                cursor.execute(
-                                    f"UPDATE {self.name} SET {tuple(record_without_primary_key.keys())[0]} = %s "
-                                    f"WHERE {primary_key_string} = %s;",
-                                    [
-                                        tuple(record_without_primary_key.values())[0],
-                                        primary_key_value,
-                                    ],
-                                )
-                    else:
+                    elif len(rows) >= COPY_THRESHOLD and all(
+                        copy_compatible(value) for row in rows for value in row
+                    ):
+                        # stream large batches into a staging table, then upsert them from there in one statement
+                        staging_table = f"tablecrow_{uuid4().hex}"
                         cursor.execute(
-                            f'INSERT INTO {self.name} ({", ".join(columns)}) VALUES %s;',
-                            [tuple(values)],
+                            f'CREATE TEMPORARY TABLE {staging_table} ON COMMIT DROP AS SELECT {", ".join(columns)} FROM {self.name} WITH NO DATA;'
+                            + "".join(
+                                f"ALTER TABLE {staging_table} ALTER COLUMN {column} TYPE BYTEA USING NULL;"
+                                for column in columns
+                                if column in geometry_fields
+                            )
                         )
-
-                    if len(geometry_fields) > 0:
-                        geometries = {
-                            field: record[field]
-                            for field in geometry_fields
-                            if record[field] is not None
-                        }
-
-                        for field, geometry in geometries.items():
-                            cursor.execute(
-                                f"UPDATE {self.name} SET {field} = ST_GeomFromText(%s, %s) "
-                                f"WHERE {primary_key_string} = %s;",
-                                [geometry.wkt, self.crs.to_epsg(), primary_key_value],
+                        copy_rows(cursor, staging_table, columns, rows)
+                        values = ", ".join(
+                            (
+                                f"ST_GeomFromWKB({column}, {srid})"
+                                if column in geometry_fields
+                                else column
+                            )
+                            for column in columns
+                        )
+                        cursor.execute(
+                            f'INSERT INTO {self.name} ({", ".join(columns)}) SELECT {values} FROM {staging_table} '
+                            f"{on_conflict} RETURNING *;"
+                        )
+                        inserted_records.extend(cursor.fetchall())
+                    else:
+                        template = ", ".join(
+                            (
+                                "ST_GeomFromWKB(%s, %s)"
+                                if column in geometry_fields
+                                else "%s"
                             )
-        connection.close()
+                            for column in columns
+                        )
+                        inserted_records.extend(
+                            execute_values(
+                                cursor,
+                                f'INSERT INTO {self.name} ({", ".join(columns)}) VALUES %s {on_conflict} RETURNING *;',
+                                [
+                                    tuple(
+                                        parameter
+                                        for column, value in zip(columns, row)
+                                        for parameter in (
+                                            (psycopg2.Binary(value), srid)
+                                            if column in geometry_fields
+                                            else (value,)
+                                        )
+                                    )
+                                    for row in rows
+                                ],
+                                template=f"({template})",
+                                page_size=INSERT_PAGE_SIZE,
+                                fetch=True,
+                            )
+                        )
 
-    def delete_where(self, where: Union[Mapping[str, Any], str, List[str]]):
-        if not self.connected:
-            raise ConnectionError(
-                f"no connection to {self.username}@{self.hostname}:{self.port}/{self.database}/{self.name}"
-            )
+        return [
+            parse_record_values(dict(record), self.fields)
+            for record in inserted_records
+        ]
 
+    def delete_where(self, where: Union[Mapping[str, Any], str, List[str]]):
         where_clause, where_values = self.__where_clause(where)
 
-        with self.connection as connection:
+        with self.__connect() as connection:
             with connection.cursor() as cursor:
                 if where_clause is None:
                     cursor.execute(f"TRUNCATE {self.name};")
@@ -555,21 +515,18 @@ class PostGresTable(DatabaseTable):
                         raise KeyError(error)
                     except psycopg2.errors.SyntaxError as error:
                         raise SyntaxError(f"invalid SQL syntax - {error}")
-        connection.close()
 
     def __len__(self) -> int:
-        with self.connection as connection:
+        with self.__connect() as connection:
             with connection.cursor() as cursor:
                 cursor.execute(f"SELECT COUNT(*) FROM {self.name};")
                 length = cursor.fetchone()[0]
-        connection.close()
         return length
 
     def delete_table(self):
-        with self.connection as connection:
+        with self.__connect() as connection:
             with connection.cursor() as cursor:
                 cursor.execute(f"DROP TABLE {self.name};")
-        connection.close()
 
     def __repr__(self) -> str:
         return (
@@ -580,6 +537,329 @@ class PostGresTable(DatabaseTable):
             f'{", ".join(key + "=" + repr(value) for key, value in self.kwargs.items())})'
         )
 
+    def __iter__(self) -> Generator:
+        yield from self.__select(
+            f'SELECT {", ".join(self.fields.keys())} FROM {self.name};'
+        )
+
+    def __select(
+        self, query: str, values: List[Any] = None
+    ) -> Generator[Dict[str, Any], None, None]:
+        with self.__connect() as connection:
+            # a named cursor is server-side, and fetches records in batches of `itersize` while iterating
+            with connection.cursor(
+                name=f"tablecrow_{uuid4().hex}", cursor_factory=RealDictCursor
+            ) as cursor:
+                cursor.execute(query, values)
+                for record in cursor:
+                    yield parse_record_values(dict(record), self.fields)
+
+    def __select_prepared(self, query: str, values: List[Any]) -> List[Dict[str, Any]]:
+        """run the given query as a prepared statement, which is parsed and planned once per connection"""
+
+        with self.__connect() as connection:
+            # prepared statements belong to the database session, so they are tracked per connection
+            prepared_statements = PREPARED_STATEMENTS.setdefault(connection, {})
+            with connection.cursor(cursor_factory=RealDictCursor) as cursor:
+                try:
+                    self.__execute_prepared(cursor, prepared_statements, query, values)
+                except psycopg2.errors.FeatureNotSupported:
+                    # the table was recreated with different column types since the statement was prepared
+                    connection.rollback()
+                    cursor.execute(f"DEALLOCATE {prepared_statements.pop(query)};")
+                    self.__execute_prepared(cursor, prepared_statements, query, values)
+                return [
+                    parse_record_values(dict(record), self.fields) for record in cursor
+                ]
+
+    @staticmethod
+    def __execute_prepared(
+        cursor: psycopg2._psycopg.cursor,
+        prepared_statements: Dict[str, str],
+        query: str,
+        values: List[Any],
+    ):
+        """execute the given query, preparing it on the cursor's connection if it has not been yet"""
+
+        if query in prepared_statements:
+            # move the statement to the end of the cache, as the most recently used
+            prepared_statements[query] = prepared_statements.pop(query)
+        else:
+            statement_name = f"tablecrow_{uuid4().hex}"
+            # PREPARE takes numbered parameters instead of placeholders
+            parameter_numbers = count(1)
+            cursor.execute(
+                f"PREPARE {statement_name} AS "
+                + re.sub(
+                    "%(%|s)",
+                    lambda match: (
+                        "%" if match.group(1) == "%" else f"${next(parameter_numbers)}"
+                    ),
+                    query,
+                )
+            )
+            prepared_statements[query] = statement_name
+            if len(prepared_statements) > PREPARED_STATEMENT_CACHE_SIZE:
+                least_recently_used = next(iter(prepared_statements))
+                cursor.execute(
+                    f"DEALLOCATE {prepared_statements.pop(least_recently_used)};"
+                )
+
+        cursor.execute(
+            f'EXECUTE {prepared_statements[query]} ({", ".join("%s" for _ in values)});',
+            values,
+        )
+
+    def __upsert_rows(
+        self,
+        cursor: psycopg2._psycopg.cursor,
+        columns: List[str],
+        rows: List[Tuple[Any, ...]],
+        srid: int,
+    ) -> List[Dict[str, Any]]:
+        """update each of the given rows in place, or insert it if no record has its primary key"""
+
+        geometry_fields = self.geometry_fields
+        update_columns = [
+            column for column in columns if column not in self.primary_key
+        ]
+
+        def placeholder(column: str) -> str:
+            return "ST_GeomFromWKB(%s, %s)" if column in geometry_fields else "%s"
+
+        def parameters(values: Dict[str, Any], columns: List[str]) -> List[Any]:
+            return [
+                parameter
+                for column in columns
+                for parameter in (
+                    (psycopg2.Binary(values[column]), srid)
+                    if column in geometry_fields
+                    else (values[column],)
+                )
+            ]
+
+        key_clause = " AND ".join(f"{field} = %s" for field in self.primary_key)
+        assignments = ", ".join(
+            f"{column} = {placeholder(column)}" for column in update_columns
+        )
+        template = ", ".join(placeholder(column) for column in columns)
+
+        upserted_records = []
+        for row in rows:
+            values = dict(zip(columns, row))
+            key_values = [values[field] for field in self.primary_key]
+
+            if len(update_columns) > 0:
+                cursor.execute(
+                    f"UPDATE {self.name} SET {assignments} WHERE {key_clause} RETURNING *;",
+                    parameters(values, update_columns) + key_values,
+                )
+            else:
+                cursor.execute(
+                    f"SELECT * FROM {self.name} WHERE {key_clause};", key_values
+                )
+            existing_records = cursor.fetchall()
+
+            if len(existing_records) == 0:
+                cursor.execute(
+                    f'INSERT INTO {self.name} ({", ".join(columns)}) VALUES ({template}) RETURNING *;',
+                    parameters(values, columns),
+                )
+                existing_records = cursor.fetchall()
+            upserted_records.extend(existing_records)
+
+        return upserted_records
+
+    @contextmanager
+    def __connect(self) -> Generator[connection, None, None]:
+        """borrow a connection from the pool, within a transaction"""
+
+        try:
+            pool = self.connection_pool
+            connection = pool.getconn()
+        except (psycopg2.OperationalError, PoolError) as error:
+            raise ConnectionError(
+                f"no connection to {self.username}@{self.hostname}:{self.port}/{self.database}/{self.name}: {error}"
+            ) from error
+        try:
+            with connection:
+                yield connection
+        finally:
+            pool.putconn(connection)
+
+    def __create_table(self, cursor: psycopg2._psycopg.cursor):
+        statements = [f"CREATE TABLE {self.name} ({self.schema});"]
+        self.__has_unique_key = True
+
+        # let PostGres name the spatial indices, so they cannot collide with those of a renamed copy of this table
+        for field in self.geometry_fields:
+            statements.append(f"CREATE INDEX ON {self.name} USING GIST ({field});")
+
+        for user in self.users:
+            statements.append(
+                f"GRANT INSERT, SELECT, UPDATE, DELETE ON TABLE public.{self.name} TO {user};"
+            )
+
+        cursor.execute(" ".join(statements))
+
+    def __sync_schema(self, cursor: psycopg2._psycopg.cursor):
+        """create the remote table, or bring the schemas of the local and remote tables in line with each other"""
+
+        exists, remote_fields = database_table_probe(cursor, self.name)
+        if not exists:
+            self.logger.debug(f'creating remote table "{self.database}/{self.name}"')
+            self.__create_table(cursor)
+            return
+
+        if database_table_is_inherited(cursor, self.name):
+            raise RuntimeError(
+                f'inheritance of table "{self.database}/{self.name}" will cause unexpected behaviour; aborting'
+            )
+
+        # a table created elsewhere might not have a constraint with which to resolve conflicting inserts
+        self.__has_unique_key = database_table_has_unique_key(
+            cursor, self.name, self.primary_key
+        )
+        if not self.__has_unique_key:
+            self.logger.warning(
+                f'no unique constraint on "{self.database}/{self.name}" matches primary key {self.primary_key}; '
+                f"records will be upserted one at a time"
+            )
+
+        remote_fields = self.__parse_remote_fields(remote_fields)
+        if list(remote_fields) == list(self.fields):
+            return
+
+        self.logger.warning(
+            f'schema of existing table "{self.database}/{self.name}" differs from given fields'
+        )
+
+        remote_fields_not_in_local_table = {
+            field: value
+            for field, value in remote_fields.items()
+            if field not in self.fields
+        }
+        if len(remote_fields_not_in_local_table) > 0:
+            self.logger.warning(
+                f"remote table has {len(remote_fields_not_in_local_table)} fields not in local table: {list(remote_fields_not_in_local_table)}"
+            )
+            self.logger.warning(
+                f"adding {len(remote_fields_not_in_local_table)} fields to local table: {list(remote_fields_not_in_local_table)}"
+            )
+
+            self._DatabaseTable__fields.update(remote_fields_not_in_local_table)
+            self._DatabaseTable__fields = {
+                field: self._DatabaseTable__fields[field] for field in remote_fields
+            }
+
+        local_fields_not_in_remote_table = {
+            field: value
+            for field, value in self.fields.items()
+            if field not in remote_fields
+        }
+        if len(local_fields_not_in_remote_table) > 0:
+            self.logger.warning(
+                f"local table has {len(local_fields_not_in_remote_table)} fields not in remote table: {list(local_fields_not_in_remote_table)}"
+            )
+            self.logger.warning(
+                f"adding {len(local_fields_not_in_remote_table)} fields to remote table: {list(local_fields_not_in_remote_table)}"
+            )
+
+        if list(remote_fields) == list(self.fields):
+            return
+
+        self.logger.warning(f'altering schema of "{self.database}/{self.name}"')
+        self.logger.debug(remote_fields)
+        self.logger.debug(self.fields)
+
+        if (
+            list(self.fields)[: len(remote_fields)] == list(remote_fields)
+            and self.__has_unique_key
+        ):
+            # fields after the existing ones can be added to the table in place, if its key is unchanged
+            statements = []
+            for field, field_type in local_fields_not_in_remote_table.items():
+                statements.append(
+                    f"ALTER TABLE {self.name} ADD COLUMN {self.__field_schema(field, field_type)};"
+                )
+                if field in self.geometry_fields:
+                    statements.append(
+                        f"CREATE INDEX ON {self.name} USING GIST ({field});"
+                    )
+            cursor.execute(" ".join(statements))
+        else:
+            # PostGres cannot reorder columns, so the table is copied into one with the new schema
+            copy_table_name = f"old_{self.name}"
+            copy_table_fields = ", ".join(remote_fields)
+
+            cursor.execute(
+                f"DROP TABLE IF EXISTS {copy_table_name}; "
+                f"ALTER TABLE {self.name} RENAME TO {copy_table_name};"
+            )
+            self.__create_table(cursor)
+            cursor.execute(
+                f"INSERT INTO {self.name} ({copy_table_fields}) SELECT {copy_table_fields} FROM {copy_table_name}; "
+                f"DROP TABLE {copy_table_name};"
+            )
+
+    def __parse_remote_fields(self, fields: Dict[str, str]) -> Dict[str, type]:
+        """Python types of the given PostGres data types"""
+
+        fields = dict(fields)
+        for field, field_type in fields.items():
+            dimensions = field_type.count("_")
+            field_type = field_type.strip("_")
+
+            field_type = field_type.lower()
+            if field_type == "geometry":
+                if self._DatabaseTable__fields is not None and field in self.fields:
+                    fields[field] = self.fields[field]
+                    continue
+
+            for python_type, postgres_type in self.FIELD_TYPES.items():
+                if postgres_type.lower() == field_type:
+                    if field_type == "geometry":
+                        if python_type not in globals():
+                            exec(f"from shapely.geometry import {python_type}")
+                    field_type = eval(python_type)
+                    break
+            else:
+                for python_type, postgres_type in self.FIELD_TYPES.items():
+                    if python_type.lower() in field_type:
+                        field_type = eval(python_type)
+                        break
+                else:
+                    field_type = str
+
+            for _ in range(dimensions):
+                field_type = [field_type]
+            fields[field] = field_type
+        return fields
+
+    def __field_schema(self, field: str, field_type: type) -> str:
+        """PostGres column definition of the given field"""
+
+        field_type = subscripted_type(field_type)
+
+        if field_type in [list, tuple, Sequence, Collection]:
+            field_type = [typing_get_args(field_type[0])]
+        dimensions = 0
+        while isinstance(field_type, Sequence) and not isinstance(field_type, str):
+            if len(field_type) > 0:
+                field_type = field_type[0]
+            else:
+                field_type = list
+            dimensions += 1
+        if isinstance(field_type, Mapping):
+            field_type = dict
+
+        try:
+            field_type = self.FIELD_TYPES[field_type.__name__]
+        except KeyError:
+            raise TypeError(f'PostGres does not support type "{field_type}"')
+
+        return f'{field} {field_type}{"[]" * dimensions}'
+
     def __where_clause(self, where: Dict[str, Union[Any, List]]) -> (str, List):
         if (
             where is not None
@@ -603,8 +883,10 @@ class PostGresTable(DatabaseTable):
                     if isinstance(value, BaseGeometry) or isinstance(
                         value, BaseMultipartGeometry
                     ):
-                        where_clause.append(f"{field} = ST_GeomFromText(%s, %s)")
-                        where_values.extend([value.wkt, self.crs.to_epsg()])
+                        where_clause.append(f"{field} = ST_GeomFromWKB(%s, %s)")
+                        where_values.extend(
+                            [psycopg2.Binary(value.wkb), self.crs.to_epsg()]
+                        )
                     else:
                         if isinstance(field_type, list):
                             if not isinstance(value, Sequence) or isinstance(
@@ -613,12 +895,11 @@ class PostGresTable(DatabaseTable):
                                 statement = f"%s = ANY({field})"
                             else:
                                 if fields is None:
-                                    with self.connection as connection:
+                                    with self.__connect() as connection:
                                         with connection.cursor() as cursor:
                                             fields = database_table_fields(
                                                 cursor, self.name
                                             )
-                                    connection.close()
                                 field_type = fields[field]
                                 dimensions = field_type.count("_")
                                 field_type = field_type.strip("_")
@@ -626,10 +907,18 @@ class PostGresTable(DatabaseTable):
                                     f'{field} = %s::{field_type}{"[]" * dimensions}'
                                 )
                         elif value is None:
-                            statement = f"{field} IS %s"
+                            statement = f"{field} IS NULL"
+                        elif isinstance(value, range) and value.step == 1:
+                            statement = f"({field} >= %s AND {field} < %s)"
                         elif isinstance(value, Sequence) and not isinstance(value, str):
-                            statement = f"{field} IN %s"
-                            value = tuple(value)
+                            # psycopg2 sends a list of strings as `text[]`, so values are converted to the type of the field
+                            statement = f"{field} = ANY(%s)"
+                            value = [
+                                parse_record_values({field: item}, {field: field_type})[
+                                    field
+                                ]
+                                for item in value
+                            ]
                         elif isinstance(value, str) and "%" in value:
                             statement = f"{field} ILIKE %s"
                         else:
@@ -638,7 +927,10 @@ class PostGresTable(DatabaseTable):
                             elif isinstance(value, date):
                                 value = f"{value:%Y%m%d}"
                             statement = f"{field} = %s"
-                        where_values.append(value)
+                        if isinstance(value, range):
+                            where_values.extend([value.start, value.stop])
+                        elif value is not None:
+                            where_values.append(value)
                         where_clause.append(statement)
                 where_clause = " AND ".join(where_clause)
             else:
@@ -650,6 +942,81 @@ class PostGresTable(DatabaseTable):
         return where_clause, where_values
 
 
+@atexit.register
+def close_connection_pools():
+    """close all pooled connections, along with the SSH tunnels they connect through"""
+
+    while len(CONNECTION_POOLS) > 0:
+        _, (pool, tunnel) = CONNECTION_POOLS.popitem()
+        if not pool.closed:
+            pool.closeall()
+        if tunnel is not None:
+            tunnel.stop()
+
+
+def copy_compatible(value: Any) -> bool:
+    """
+    whether the given value is stored the same way when written in PostGreSQL's text COPY format as when inserted
+
+    :param value: value to check
+    :return: whether the value can be copied
+    """
+
+    # COPY drops the offset of an aware value into a column without a time zone, where INSERT would convert it
+    if isinstance(value, (datetime, time)) and value.tzinfo is not None:
+        return False
+    return isinstance(value, COPY_TYPES)
+
+
+def copy_text(value: Any) -> str:
+    """
+    serialize the given value in PostGreSQL's text COPY format
+
+    :param value: value of one of `COPY_TYPES`
+    :return: escaped text
+    """
+
+    if value is None:
+        return "\\N"
+    elif isinstance(value, bool):
+        return "t" if value else "f"
+    elif isinstance(value, bytes):
+        value = f"\\x{value.hex()}"
+    elif isinstance(value, (date, time)):
+        value = value.isoformat()
+    else:
+        value = str(value)
+    return (
+        value.replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def copy_rows(
+    cursor: psycopg2._psycopg.cursor,
+    table: str,
+    columns: List[str],
+    rows: List[Tuple[Any, ...]],
+):
+    """
+    load the given rows into the given table with a single `COPY ... FROM STDIN`
+
+    :param cursor: psycopg2 cursor
+    :param table: name of table
+    :param columns: names of the columns to fill
+    :param rows: values of each row, in the order of the columns
+    """
+
+    buffer = StringIO()
+    for row in rows:
+        buffer.write("\t".join(copy_text(value) for value in row))
+        buffer.write("\n")
+    buffer.seek(0)
+    cursor.copy_expert(f'COPY {table} ({", ".join(columns)}) FROM STDIN;', buffer)
+
+
 def database_tables(cursor: Cursor, user_defined: bool = True) -> List[str]:
     """
     list of tables within the given PostGreSQL database
@@ -685,6 +1052,32 @@ def database_has_table(cursor: psycopg2._psycopg.cursor, table: str) -> bool:
     return cursor.fetchone()[0]
 
 
+def database_table_probe(
+    cursor: psycopg2._psycopg.cursor, table: str
+) -> Tuple[bool, Dict[str, str]]:
+    """
+    whether the given table exists within the given PostGreSQL database, along with its fields, in a single query
+
+    :param cursor: psycopg2 cursor
+    :param table: name of table
+    :return: whether table exists, and mapping of column names to the PostGres data type
+    """
+
+    # the existence check is always returned as a row, even when there are no matching columns
+    cursor.execute(
+        "SELECT existence.regclass IS NOT NULL, columns.column_name, columns.udt_name "
+        "FROM (SELECT to_regclass(%s) AS regclass) AS existence "
+        "LEFT JOIN information_schema.columns AS columns "
+        "ON existence.regclass IS NOT NULL AND columns.table_name = %s "
+        "ORDER BY columns.ordinal_position;",
+        [table, table.lower()],
+    )
+    records = cursor.fetchall()
+    return records[0][0], {
+        record[1]: record[2] for record in records if record[1] is not None
+    }
+
+
 def database_table_is_inherited(cursor: psycopg2._psycopg.cursor, table: str) -> bool:
     """
     whether the given PostGreSQL table is inherited
@@ -701,6 +1094,28 @@ def database_table_is_inherited(cursor: psycopg2._psycopg.cursor, table: str) ->
     return cursor.fetchone()[0]
 
 
+def database_table_has_unique_key(
+    cursor: psycopg2._psycopg.cursor, table: str, fields: List[str]
+) -> bool:
+    """
+    whether the given PostGreSQL table has a unique constraint on exactly the given fields, which `ON CONFLICT` can use
+
+    :param cursor: psycopg2 cursor
+    :param table: name of table
+    :param fields: names of fields
+    :return: whether a matching unique constraint exists
+    """
+
+    cursor.execute(
+        "SELECT EXISTS(SELECT 1 FROM pg_index WHERE indrelid = to_regclass(%s) "
+        "AND indisunique AND indpred IS NULL AND indexprs IS NULL AND indnatts = %s "
+        "AND ARRAY(SELECT attname::text FROM pg_attribute "
+        "WHERE attrelid = indrelid AND attnum = ANY(indkey)) @> %s::text[]);",
+        [table, len(fields), list(fields)],
+    )
+    return cursor.fetchone()[0]
+
+
 def database_table_fields(
     cursor: psycopg2._psycopg.cursor, table: str
 ) -> Dict[str, str]:
@@ -713,7 +1128,7 @@ def database_table_fields(
     """
 
     cursor.execute(
-        "SELECT column_name, udt_name FROM information_schema.columns WHERE table_name=%s;",
+        "SELECT column_name, udt_name FROM information_schema.columns WHERE table_name=%s ORDER BY ordinal_position;",
         [table],
     )
     return {record[0]: record[1] for record in cursor.fetchall()}
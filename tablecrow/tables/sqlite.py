@@ -1,3 +1,4 @@
+from contextlib import contextmanager
 from datetime import date, datetime
 from functools import lru_cache
 from logging import Logger
@@ -5,7 +6,7 @@ from os import PathLike
 from pathlib import Path
 import sqlite3
 from sqlite3 import Connection, Cursor
-from typing import Any, Dict, List, Mapping, Sequence, Union
+from typing import Any, Dict, Generator, List, Mapping, Sequence, Tuple, Union
 
 from pyproj import CRS
 from shapely.geometry.base import BaseGeometry, BaseMultipartGeometry
@@ -13,6 +14,10 @@ from shapely.geometry.base import BaseGeometry, BaseMultipartGeometry
 from tablecrow.tables.base import DatabaseTable, parse_record_values
 
 SSH_DEFAULT_PORT = 22
+IN_MEMORY_DATABASE = ":memory:"
+UPSERT_SQLITE_VERSION = (3, 24, 0)
+# the lowest limit on the number of parameters in a statement, of any SQLite version
+SQLITE_MAX_VARIABLE_NUMBER = 999
 
 GEOMETRY_TYPES = [
     "Point",
@@ -47,7 +52,15 @@ class SQLiteTable(DatabaseTable):
         crs: CRS = None,
         logger: Logger = None,
     ):
-        if "://" not in str(path):
+        self.__connection = None
+        self.__in_transaction = False
+
+        # in-memory databases and `file:` URIs are passed to SQLite as given
+        if (
+            "://" not in str(path)
+            and str(path) != IN_MEMORY_DATABASE
+            and not str(path).startswith("file:")
+        ):
             path = str(Path(path).expanduser().resolve())
 
         super().__init__(
@@ -64,7 +77,7 @@ class SQLiteTable(DatabaseTable):
             raise ConnectionError(f"no connection to {self.path}/{self.name}")
 
         if self.fields is None:
-            with self.connection:
+            with self.__connect():
                 cursor = self.connection.cursor()
                 self._DatabaseTable__fields = database_table_fields(cursor, self.name)
 
@@ -90,10 +103,16 @@ class SQLiteTable(DatabaseTable):
                     )
                 raise EnvironmentError(f"SpatiaLite module was not found; {message}")
 
-        with self.connection:
+        with self.__connect():
             cursor = self.connection.cursor()
-            if database_has_table(cursor, self.name):
-                remote_fields = self.remote_fields
+            # check whether the table exists, and read its fields, in one query
+            remote_fields = self.remote_fields
+            if remote_fields is not None:
+                # a table created elsewhere might not have a constraint with which to resolve conflicting inserts
+                self.__upsert = database_table_has_unique_key(
+                    cursor, self.name, self.primary_key
+                )
+
                 if list(remote_fields) != list(self.fields):
                     self.logger.warning(
                         f'schema of existing table "{self.database}/{self.name}" differs from given fields'
@@ -142,14 +161,14 @@ class SQLiteTable(DatabaseTable):
 
                         copy_table_name = f"old_{self.name}"
 
-                        if database_has_table(cursor, copy_table_name):
-                            cursor.execute(f"DROP TABLE {copy_table_name};")
+                        cursor.execute(f"DROP TABLE IF EXISTS {copy_table_name};")
 
                         cursor.execute(
                             f"ALTER TABLE {self.name} RENAME TO {copy_table_name};"
                         )
 
                         cursor.execute(f"CREATE TABLE {self.name} ({self.schema});")
+                        self.__upsert = True
                         cursor.execute(f"PRAGMA table_info({copy_table_name})")
                         copy_table_fields = [record[1] for record in cursor.fetchall()]
 
@@ -163,6 +182,18 @@ class SQLiteTable(DatabaseTable):
                     f'creating remote table "{self.database}/{self.name}"'
                 )
                 cursor.execute(f"CREATE TABLE {self.name} ({self.schema});")
+                self.__upsert = True
+
+            # UPSERT was added in SQLite 3.24
+            if sqlite3.sqlite_version_info < UPSERT_SQLITE_VERSION:
+                self.__upsert = False
+
+            if not self.__upsert:
+                self.logger.warning(
+                    f'cannot upsert into "{self.database}/{self.name}" with SQLite {sqlite3.sqlite_version}, '
+                    f"or without a unique constraint matching primary key {self.primary_key}; "
+                    f"records will be upserted one at a time"
+                )
 
     @property
     @lru_cache(maxsize=1)
@@ -170,9 +201,41 @@ class SQLiteTable(DatabaseTable):
         return Path(self.resource)
 
     @property
-    @lru_cache(maxsize=1)
     def connection(self) -> Connection:
-        return sqlite3.connect(database=self.path)
+        if self.__connection is None:
+            self.__connection = sqlite3.connect(
+                database=self.resource, uri=self.resource.startswith("file:")
+            )
+        return self.__connection
+
+    @contextmanager
+    def transaction(self) -> Generator[Connection, None, None]:
+        """
+        group every operation on this table within the context into a single transaction, which is committed on exit,
+        or rolled back if an error is raised
+
+        >>> with table.transaction():
+        ...     table.insert(records)
+        ...     table[4] = record
+        """
+
+        # operations within an enclosing transaction are committed along with it
+        if self.__in_transaction:
+            yield self.connection
+            return
+
+        # take the write lock up front, so that reads before the first write are part of the transaction
+        self.connection.execute("BEGIN IMMEDIATE;")
+        self.__in_transaction = True
+        try:
+            yield self.connection
+        except BaseException:
+            self.connection.rollback()
+            raise
+        else:
+            self.connection.commit()
+        finally:
+            self.__in_transaction = False
 
     @property
     def database(self) -> str:
@@ -181,7 +244,7 @@ class SQLiteTable(DatabaseTable):
     @property
     def exists(self) -> bool:
         if self.connected:
-            with self.connection:
+            with self.__connect():
                 cursor = self.connection.cursor()
                 return database_has_table(cursor, self.name)
 
@@ -218,11 +281,10 @@ class SQLiteTable(DatabaseTable):
 
         geometry_fields = [geometry_type.lower() for geometry_type in GEOMETRY_TYPES]
 
-        with self.connection:
+        with self.__connect():
             cursor = self.connection.cursor()
-            if database_has_table(cursor, self.name):
-                fields = database_table_fields(cursor, self.name)
-
+            exists, fields = database_table_probe(cursor, self.name)
+            if exists:
                 for field, field_type in fields.items():
                     field_type = field_type.lower()
                     if field_type in geometry_fields:
@@ -254,8 +316,12 @@ class SQLiteTable(DatabaseTable):
     @property
     def connected(self) -> bool:
         connected = False
-        if self.path.exists():
-            with self.connection:
+        if (
+            self.path.exists()
+            or self.resource == IN_MEMORY_DATABASE
+            or self.resource.startswith("file:")
+        ):
+            with self.__connect():
                 try:
                     cursor = self.connection.cursor()
                     cursor.execute("SELECT 1;")
@@ -273,7 +339,7 @@ class SQLiteTable(DatabaseTable):
 
         where_clause, where_values = self.__where_clause(where)
 
-        with self.connection:
+        with self.__connect():
             cursor = self.connection.cursor()
             if where_clause is None:
                 cursor.execute(
@@ -313,11 +379,14 @@ class SQLiteTable(DatabaseTable):
         if geometry_fields is None or len(geometry_fields) == 0:
             geometry_fields = list(self.geometry_fields)
 
+        geometry_wkb = geometry.wkb
+        srid = crs.to_epsg()
+
         where_clause = []
         where_values = []
         for field in geometry_fields:
-            where_values.extend([geometry.wkt, crs.to_epsg()])
-            geometry_string = "GeomFromText(?, ?)"
+            where_values.extend([geometry_wkb, srid])
+            geometry_string = "GeomFromWKB(?, ?)"
             if crs != self.crs:
                 geometry_string = f"Transform({geometry_string}, ?)"
                 where_values.append(self.crs.to_epsg())
@@ -330,7 +399,7 @@ class SQLiteTable(DatabaseTable):
             if field_type.__name__ not in GEOMETRY_TYPES
         }
 
-        with self.connection:
+        with self.__connect():
             cursor = self.connection.cursor()
             cursor.execute(
                 f'SELECT {", ".join(non_geometry_fields)} '
@@ -367,9 +436,11 @@ class SQLiteTable(DatabaseTable):
         ]
         return [{field: record[field] for field in self.fields} for record in records]
 
-    def insert(self, records: List[Dict[str, Any]]):
+    def insert(self, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         if isinstance(records, dict):
             records = [records]
+        else:
+            records = list(records)
 
         if not all(field in record for field in self.primary_key for record in records):
             raise KeyError(
@@ -379,95 +450,152 @@ class SQLiteTable(DatabaseTable):
         if not self.connected:
             raise ConnectionError(f"no connection to {self.database}/{self.name}")
 
-        with self.connection:
-            cursor = self.connection.cursor()
-            for record in records:
-                if len(self.primary_key) == 1:
-                    primary_key_string = self.primary_key[0]
-                    primary_key_value = record[self.primary_key[0]]
-                else:
-                    primary_key_string = f'({", ".join(self.primary_key)})'
-                    primary_key_value = tuple(
-                        record[primary_key] for primary_key in self.primary_key
-                    )
+        fields = self.fields
+        geometry_fields = self.geometry_fields
+        srid = self.crs.to_epsg() if len(geometry_fields) > 0 else None
 
-                record_fields_not_in_local_table = [
-                    field for field in record if field not in self.fields
-                ]
-                if len(record_fields_not_in_local_table) > 0:
-                    self.logger.warning(
-                        f"record has {len(record_fields_not_in_local_table)} fields not in the local table"
-                        f" that will not be inserted: {record_fields_not_in_local_table}"
-                    )
+        # group consecutive records with the same columns, so that each group is upserted by a single compiled statement
+        batches = []
+        for record in records:
+            record_fields_not_in_local_table = [
+                field for field in record if field not in fields
+            ]
+            if len(record_fields_not_in_local_table) > 0:
+                self.logger.warning(
+                    f"record has {len(record_fields_not_in_local_table)} fields not in the local table"
+                    f" that will not be inserted: {record_fields_not_in_local_table}"
+                )
 
-                local_fields_in_record = [
-                    field for field in self.fields if field in record
-                ]
-                geometry_fields = [
-                    field for field in self.geometry_fields if field in record
-                ]
+            columns = {}
+            for field in fields:
+                if field not in record:
+                    continue
+                value = record[field]
+                if field in geometry_fields:
+                    # skip empty geometries, so that existing geometries are not overwritten
+                    if value is None:
+                        continue
+                    value = value.wkb
+                columns[field] = value
+
+            if len(batches) == 0 or list(columns) != batches[-1][0]:
+                batches.append((list(columns), []))
+            # the parameters of each column, as a geometry takes both its WKB and its SRID
+            batches[-1][1].append(
+                {
+                    field: (value, srid) if field in geometry_fields else (value,)
+                    for field, value in columns.items()
+                }
+            )
 
-                columns = [
-                    field
-                    for field in local_fields_in_record
-                    if field not in geometry_fields
-                ]
-                values = [
-                    record[field]
-                    for field in local_fields_in_record
-                    if field not in geometry_fields
+        with self.__connect():
+            cursor = self.connection.cursor()
+            for columns, rows in batches:
+                placeholders = {
+                    column: "GeomFromWKB(?, ?)" if column in geometry_fields else "?"
+                    for column in columns
+                }
+                update_columns = [
+                    column for column in columns if column not in self.primary_key
                 ]
 
-                if primary_key_value in self:
-                    record_without_primary_key = {
-                        column: value
-                        for column, value in zip(columns, values)
-                        if column not in self.primary_key
-                    }
-                    if not isinstance(primary_key_value, Sequence) or isinstance(
-                        primary_key_value, str
-                    ):
-                        primary_key_value = [primary_key_value]
-                    if len(record_without_primary_key) > 0:
-                        cursor.execute(
-                            f"UPDATE {self.name} "
-                            f'SET ({", ".join(record_without_primary_key.keys())}) = ({", ".join("?" for _ in record_without_primary_key)})'
-                            f' WHERE {primary_key_string} = ({", ".join("?" for _ in primary_key_value)});',
+                if self.__upsert:
+                    if len(update_columns) > 0:
+                        on_conflict = f'DO UPDATE SET {", ".join(f"{column} = excluded.{column}" for column in update_columns)}'
+                    else:
+                        on_conflict = "DO NOTHING"
+
+                    cursor.executemany(
+                        f'INSERT INTO {self.name} ({", ".join(columns)}) VALUES ({", ".join(placeholders.values())}) '
+                        f'ON CONFLICT ({", ".join(self.primary_key)}) {on_conflict};',
+                        (
                             [
-                                *record_without_primary_key.values(),
-                                *primary_key_value,
-                            ],
-                        )
+                                parameter
+                                for column in columns
+                                for parameter in row[column]
+                            ]
+                            for row in rows
+                        ),
+                    )
                 else:
-                    cursor.execute(
-                        f'INSERT INTO {self.name} ({", ".join(columns)}) VALUES ({", ".join("?" for _ in values)});',
-                        values,
+                    # update each record in place, then insert it if no record has its primary key
+                    key_clause = " AND ".join(
+                        f"{field} = ?" for field in self.primary_key
                     )
-
-                if len(geometry_fields) > 0:
-                    geometries = {
-                        field: record[field]
-                        for field in geometry_fields
-                        if record[field] is not None
-                    }
-
-                    for field, geometry in geometries.items():
+                    assignments = ", ".join(
+                        f"{column} = {placeholders[column]}"
+                        for column in update_columns
+                    )
+                    for row in rows:
+                        key_values = [row[field][0] for field in self.primary_key]
+                        if len(update_columns) > 0:
+                            cursor.execute(
+                                f"UPDATE {self.name} SET {assignments} WHERE {key_clause};",
+                                [
+                                    parameter
+                                    for column in update_columns
+                                    for parameter in row[column]
+                                ]
+                                + key_values,
+                            )
                         cursor.execute(
-                            f"UPDATE {self.name} SET {field} = GeomFromText(?, ?) "
-                            f"WHERE {primary_key_string} = ?;",
-                            [geometry.wkt, self.crs.to_epsg(), primary_key_value],
+                            f'INSERT INTO {self.name} ({", ".join(columns)}) SELECT {", ".join(placeholders.values())} '
+                            f"WHERE NOT EXISTS (SELECT 1 FROM {self.name} WHERE {key_clause});",
+                            [
+                                parameter
+                                for column in columns
+                                for parameter in row[column]
+                            ]
+                            + key_values,
                         )
 
+            # read back the stored records, with as many keys per query as SQLite allows parameters
+            primary_key_fields = {field: fields[field] for field in self.primary_key}
+            keys = [
+                tuple(
+                    parse_record_values(
+                        {field: record[field] for field in self.primary_key},
+                        primary_key_fields,
+                    ).values()
+                )
+                for record in records
+            ]
+            unique_keys = list(dict.fromkeys(keys))
+            keys_per_query = SQLITE_MAX_VARIABLE_NUMBER // len(self.primary_key)
+            key_placeholder = f'({", ".join("?" for _ in self.primary_key)})'
+            field_string = ", ".join(
+                f"asbinary({field})" if field in geometry_fields else field
+                for field in fields
+            )
+            stored_records = {}
+            for index in range(0, len(unique_keys), keys_per_query):
+                query_keys = unique_keys[index : index + keys_per_query]
+                cursor.execute(
+                    f"SELECT {field_string} FROM {self.name} "
+                    f'WHERE ({", ".join(self.primary_key)}) IN (VALUES {", ".join(key_placeholder for _ in query_keys)});',
+                    [value for key in query_keys for value in key],
+                )
+                for stored_record in cursor.fetchall():
+                    stored_record = parse_record_values(
+                        dict(zip(fields, stored_record)), fields
+                    )
+                    stored_records[
+                        tuple(stored_record[field] for field in self.primary_key)
+                    ] = stored_record
+
+        return [stored_records[key] for key in keys]
+
     def delete_where(self, where: Union[Mapping[str, Any], str, List[str]]):
         if not self.connected:
             raise ConnectionError(f"no connection to {self.database}/{self.name}")
 
         where_clause, where_values = self.__where_clause(where)
 
-        with self.connection:
+        with self.__connect():
             cursor = self.connection.cursor()
             if where_clause is None:
-                cursor.execute(f"TRUNCATE {self.name};")
+                # SQLite has no TRUNCATE
+                cursor.execute(f"DELETE FROM {self.name};")
             else:
                 try:
                     cursor.execute(
@@ -479,13 +607,13 @@ class SQLiteTable(DatabaseTable):
                     raise KeyError(error)
 
     def __len__(self) -> int:
-        with self.connection:
+        with self.__connect():
             cursor = self.connection.cursor()
             cursor.execute(f"SELECT COUNT(*) FROM {self.name};")
             return cursor.fetchone()[0]
 
     def delete_table(self):
-        with self.connection:
+        with self.__connect():
             cursor = self.connection.cursor()
             cursor.execute(f"DROP TABLE {self.name};")
 
@@ -495,6 +623,16 @@ class SQLiteTable(DatabaseTable):
             f"{repr(self.fields)}, {repr(self.primary_key)}, {repr(self.crs.to_epsg()) if self.crs is not None else None})"
         )
 
+    @contextmanager
+    def __connect(self) -> Generator[Connection, None, None]:
+        """the connection, within the enclosing transaction, or within one of its own that is committed on exit"""
+
+        if self.__in_transaction:
+            yield self.connection
+        else:
+            with self.connection:
+                yield self.connection
+
     def __where_clause(self, where: Dict[str, Union[Any, list]]) -> (str, List[Any]):
         if (
             where is not None
@@ -518,8 +656,8 @@ class SQLiteTable(DatabaseTable):
                     if isinstance(value, BaseGeometry) or isinstance(
                         value, BaseMultipartGeometry
                     ):
-                        where_clause.append(f"{field} = GeomFromText(?, ?)")
-                        where_values.extend([value.wkt, self.crs.to_epsg()])
+                        where_clause.append(f"{field} = GeomFromWKB(?, ?)")
+                        where_values.extend([value.wkb, self.crs.to_epsg()])
                     else:
                         if isinstance(field_type, list):
                             if not isinstance(value, Sequence) or isinstance(
@@ -528,7 +666,7 @@ class SQLiteTable(DatabaseTable):
                                 statement = f"? = ANY({field})"
                             else:
                                 if fields is None:
-                                    with self.connection:
+                                    with self.__connect():
                                         cursor = self.connection.cursor()
                                         fields = database_table_fields(
                                             cursor, self.name
@@ -547,8 +685,11 @@ class SQLiteTable(DatabaseTable):
                             statement = f"UPPER({field}) LIKE ?"
                             value = value.upper()
                         else:
-                            if isinstance(value, datetime) or isinstance(value, date):
-                                value = f"{value:%Y-%m-%d %H:%M:%S}"
+                            # match the ISO 8601 text that `sqlite3` stores dates and datetimes as
+                            if isinstance(value, datetime):
+                                value = value.isoformat(" ")
+                            elif isinstance(value, date):
+                                value = value.isoformat()
                             statement = f"{field} = ?"
                         if isinstance(value, Sequence) and not isinstance(value, str):
                             where_values.extend(value)
@@ -589,6 +730,45 @@ def database_has_table(cursor: Cursor, table: str) -> bool:
     return table in database_tables(cursor)
 
 
+def database_table_probe(cursor: Cursor, table: str) -> Tuple[bool, Dict[str, str]]:
+    """
+    whether the given table exists within the given SQLite database, along with its fields, in a single query
+
+    :param cursor: sqlite3 cursor
+    :param table: name of table
+    :return: whether table exists, and mapping of column names to the SQLite data type
+    """
+
+    # every SQLite table has at least one column, so a table without columns does not exist
+    cursor.execute("SELECT name, type FROM pragma_table_info(?) ORDER BY cid;", [table])
+    fields = {record[0]: record[1] for record in cursor.fetchall()}
+    return len(fields) > 0, fields
+
+
+def database_table_has_unique_key(
+    cursor: Cursor, table: str, fields: List[str]
+) -> bool:
+    """
+    whether the given SQLite table has a primary key or unique constraint on exactly the given fields, which `ON CONFLICT` can use
+
+    :param cursor: sqlite3 cursor
+    :param table: name of table
+    :param fields: names of fields
+    :return: whether a matching unique constraint exists
+    """
+
+    # a single `INTEGER PRIMARY KEY` is an alias of the row ID, and has no index of its own
+    cursor.execute(
+        "SELECT '', name FROM pragma_table_info(?) WHERE pk > 0 "
+        'UNION ALL SELECT indices.name, columns.name FROM pragma_index_list(?) AS indices, pragma_index_info(indices.name) AS columns WHERE indices."unique" AND NOT indices.partial;',
+        [table, table],
+    )
+    keys = {}
+    for key, field in cursor.fetchall():
+        keys.setdefault(key, set()).add(field)
+    return set(fields) in keys.values()
+
+
 def database_table_fields(cursor: Cursor, table: str) -> Dict[str, str]:
     """
     field names and data types of the given table, within the given SQLite database
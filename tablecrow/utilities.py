@@ -1,4 +1,5 @@
 import configparser
+from functools import lru_cache
 import logging
 from os import PathLike
 from pathlib import Path
@@ -6,6 +7,8 @@ import re
 import sys
 from typing import Dict, Union
 
+PROTOCOL_PATTERN = re.compile(r"^(?:http|ftp)s?://")
+
 
 def read_configuration(filename: PathLike) -> Dict[str, str]:
     """
@@ -15,6 +18,21 @@ def read_configuration(filename: PathLike) -> Dict[str, str]:
     :return: dictionary mapping of configuration entries
     """
 
+    if not isinstance(filename, Path):
+        filename = Path(filename)
+    filename = filename.resolve()
+    modified = filename.stat().st_mtime if filename.exists() else None
+
+    # copy the cached entries, so that callers are free to modify them
+    return {
+        section_name: dict(section)
+        for section_name, section in _parse_configuration(filename, modified).items()
+    }
+
+
+@lru_cache(maxsize=8)
+def _parse_configuration(filename: Path, modified: float = None) -> Dict[str, str]:
+    # the modification time is part of the cache key, so that an edited file is read again
     configuration_file = configparser.ConfigParser()
     configuration_file.read(filename)
     return {
@@ -44,6 +62,7 @@ def repository_root(path: PathLike = None) -> Path:
         return repository_root(path.parent)
 
 
+@lru_cache(maxsize=128)
 def split_hostname_port(hostname: str) -> (str, Union[str, None]):
     """
     split the given URL into host and port, assuming port is appended after a colon
@@ -78,10 +97,9 @@ def parse_hostname(hostname: str) -> Dict[str, str]:
 
     hostname, port = split_hostname_port(hostname)
 
-    protocol_pattern = re.compile(r"^(?:http|ftp)s?://")
-    result = re.search(protocol_pattern, hostname)
+    result = PROTOCOL_PATTERN.match(hostname)
     protocol = result.group(0) if result is not None else ""
-    hostname = re.sub(protocol_pattern, "", hostname)
+    hostname = hostname[len(protocol) :]
 
     if "@" in hostname:
         username, hostname = hostname.split("@", 1)
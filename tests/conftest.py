@@ -1,5 +1,9 @@
+from typing import Callable, Dict, List
+
 import pytest as pytest
 
+from tablecrow.tables.base import DatabaseTable
+
 
 def pytest_collection_modifyitems(config, items):
     keywordexpr = config.option.keyword
@@ -14,3 +18,27 @@ def pytest_collection_modifyitems(config, items):
             item.add_marker(skip_spatial)
         if "postgres" in item.keywords:
             item.add_marker(skip_postgres)
+
+
+@pytest.fixture(scope="module")
+def table_names(cursor) -> List[str]:
+    table_names = []
+
+    yield table_names
+
+    for table_name in table_names:
+        cursor.execute(f"DROP TABLE IF EXISTS {table_name};")
+
+
+@pytest.fixture
+def empty_table(table_type, table_names) -> Callable[..., DatabaseTable]:
+    def empty_table(
+        table_name: str, fields: Dict[str, type], **kwargs
+    ) -> DatabaseTable:
+        table = table_type(table_name=table_name, fields=fields, **kwargs)
+        table.delete_where(None)
+        if table_name not in table_names:
+            table_names.append(table_name)
+        return table
+
+    return empty_table
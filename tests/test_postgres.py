@@ -1,22 +1,37 @@
-from datetime import date, datetime
+from datetime import date, datetime, time, timedelta, timezone
 from functools import partial
 import os
+from typing import Callable, Dict
 
 import pytest
 import psycopg2
-from sshtunnel import SSHTunnelForwarder
+from psycopg2.pool import PoolError, ThreadedConnectionPool
+from sshtunnel import BaseSSHTunnelForwarderError, SSHTunnelForwarder
 
 from shapely.geometry import box, MultiPolygon, Point
 from pyproj import CRS
 
+import tablecrow.tables.postgres
 from tablecrow import PostGresTable
-from tablecrow.tables.base import DEFAULT_CRS, random_open_tcp_port
+from tablecrow.tables.base import DEFAULT_CRS
 from tablecrow.tables.postgres import (
+    close_connection_pools,
+    CONNECTION_POOL_MINIMUM_SIZE,
+    COPY_THRESHOLD,
+    copy_rows,
+    copy_text,
     database_has_table,
     database_table_fields,
+    database_table_has_unique_key,
+    database_table_probe,
     SSH_DEFAULT_PORT,
 )
-from tablecrow.utilities import read_configuration, repository_root, split_hostname_port
+from tablecrow.utilities import (
+    parse_hostname,
+    read_configuration,
+    repository_root,
+    split_hostname_port,
+)
 
 CREDENTIALS_FILENAME = repository_root() / "credentials.config"
 CREDENTIALS = read_configuration(CREDENTIALS_FILENAME)
@@ -38,68 +53,144 @@ for credential, details in default_credentials.items():
     if credential not in CREDENTIALS["postgres"]:
         CREDENTIALS["postgres"][credential] = os.getenv(*details)
 
-if (
-    "ssh_hostname" in CREDENTIALS["postgres"]
-    and CREDENTIALS["postgres"]["ssh_hostname"] is not None
-):
-    hostname, port = split_hostname_port(CREDENTIALS["postgres"]["hostname"])
-    if port is None:
-        port = PostGresTable.DEFAULT_PORT
+HOSTNAME, PORT = split_hostname_port(CREDENTIALS["postgres"]["hostname"])
+if PORT is None:
+    PORT = PostGresTable.DEFAULT_PORT
+
+WGS84 = CRS.from_epsg(4326)
+UTM_18N = CRS.from_epsg(32618)
+
+INSIDE_POLYGON = box(-77.7, 39.725, -77.4, 39.8)
+TOUCHING_POLYGON = box(-77.1, 39.575, -76.8, 39.65)
+OUTSIDE_POLYGON = box(-77.7, 39.425, -77.4, 39.5)
+CONTAINING_POLYGON = box(-77.7, 39.65, -77.1, 39.8)
+PROJECTED_CONTAINING_POLYGON = box(268397.8, 4392279.8, 320292.0, 4407509.6)
+MULTIPOLYGON = MultiPolygon([INSIDE_POLYGON, TOUCHING_POLYGON])
+
+INTERSECTING_RECORDS = [
+    {
+        "primary_key_field": 1,
+        "field_1": "inside box",
+        "field_2": MultiPolygon([INSIDE_POLYGON]),
+        "field_3": None,
+    },
+    {
+        "primary_key_field": 2,
+        "field_1": "containing box",
+        "field_2": MultiPolygon([CONTAINING_POLYGON]),
+        "field_3": None,
+    },
+    {
+        "primary_key_field": 3,
+        "field_1": "outside box with multipolygon",
+        "field_2": MultiPolygon([OUTSIDE_POLYGON]),
+        "field_3": MULTIPOLYGON,
+    },
+]
 
-    ssh_hostname, ssh_port = split_hostname_port(
-        CREDENTIALS["postgres"]["ssh_hostname"]
-    )
-    if ssh_port is None:
-        ssh_port = SSH_DEFAULT_PORT
 
-    if "@" in ssh_hostname:
-        ssh_username, ssh_hostname = ssh_hostname.split("@", 1)
+def drop_table(cursor: psycopg2._psycopg.cursor, table: str):
+    cursor.execute(f"DROP TABLE IF EXISTS {table};")
 
-    ssh_username = CREDENTIALS["postgres"]["ssh_username"]
 
-    if ssh_username is not None and ":" in ssh_username:
-        ssh_username, ssh_password = ssh_hostname.split(":", 1)
-
-    ssh_password = CREDENTIALS["postgres"]["ssh_password"]
-
-    TUNNEL = SSHTunnelForwarder(
-        (ssh_hostname, ssh_port),
-        ssh_username=ssh_username,
-        ssh_password=ssh_password,
-        remote_bind_address=("localhost", port),
-        local_bind_address=("localhost", random_open_tcp_port()),
-    )
-    TUNNEL.start()
-else:
-    TUNNEL = None
+@pytest.fixture(scope="session")
+def tunnel() -> SSHTunnelForwarder:
+    if CREDENTIALS["postgres"]["ssh_hostname"] is None:
+        yield None
+        return
 
+    ssh_credentials = parse_hostname(CREDENTIALS["postgres"]["ssh_hostname"])
+    ssh_hostname = ssh_credentials["hostname"]
+    ssh_port = ssh_credentials["port"]
+    if ssh_port is None:
+        ssh_port = SSH_DEFAULT_PORT
 
-@pytest.fixture
-def connection() -> psycopg2.connect:
-    hostname, port = split_hostname_port(CREDENTIALS["postgres"]["hostname"])
-    if port is None:
-        port = PostGresTable.DEFAULT_PORT
+    ssh_username = CREDENTIALS["postgres"]["ssh_username"]
+    if ssh_username is None:
+        ssh_username = ssh_credentials["username"]
+    ssh_password = CREDENTIALS["postgres"]["ssh_password"]
+    if ssh_password is None:
+        ssh_password = ssh_credentials["password"]
 
+    if ssh_username is not None and ":" in ssh_username:
+        ssh_username, ssh_password = ssh_username.split(":", 1)
+
+    try:
+        tunnel = SSHTunnelForwarder(
+            (ssh_hostname, ssh_port),
+            ssh_username=ssh_username,
+            ssh_password=ssh_password,
+            remote_bind_address=("localhost", PORT),
+            local_bind_address=("localhost", 0),
+            # compress traffic, skip looking up keys and configuration that password authentication does not need,
+            # and keep the tunnel alive between tests
+            compression=True,
+            allow_agent=False,
+            host_pkey_directories=[],
+            ssh_config_file=None,
+            set_keepalive=60.0,
+        )
+        tunnel.start()
+    except (ValueError, BaseSSHTunnelForwarderError) as error:
+        pytest.skip(f"SSH tunnel unavailable: {error}")
+
+    yield tunnel
+
+    tunnel.stop()
+
+
+@pytest.fixture(scope="session")
+def connection(tunnel) -> psycopg2.connect:
     connector = partial(
         psycopg2.connect,
         database=CREDENTIALS["postgres"]["database"],
         user=CREDENTIALS["postgres"]["username"],
         password=CREDENTIALS["postgres"]["password"],
+        # give up on an unreachable server quickly
+        connect_timeout=5,
     )
-    if tunnel := TUNNEL is not None:
-        try:
-            tunnel.start()
-        except Exception as error:
-            raise ConnectionError(error)
-        connection = connector(host=tunnel.local_bind_host, port=tunnel.local_bind_port)
-    else:
-        connection = connector(host=hostname, port=port)
+    try:
+        if tunnel is not None:
+            connection = connector(
+                host=tunnel.local_bind_host, port=tunnel.local_bind_port
+            )
+        else:
+            connection = connector(host=HOSTNAME, port=PORT)
+    except psycopg2.OperationalError as error:
+        pytest.skip(f"PostGres unavailable: {error}")
+
+    # commit each statement as it is sent
+    connection.autocommit = True
+
+    yield connection
+
+    connection.close()
+
+
+@pytest.fixture(scope="session")
+def cursor(connection) -> psycopg2._psycopg.cursor:
+    with connection.cursor() as cursor:
+        yield cursor
 
-    return connection
+
+@pytest.fixture(scope="session")
+def credentials(tunnel) -> Dict[str, str]:
+    # point tables at the local end of the shared tunnel
+    credentials = CREDENTIALS["postgres"].copy()
+    if tunnel is not None:
+        credentials["hostname"] = f"{tunnel.local_bind_host}:{tunnel.local_bind_port}"
+        for credential in ("ssh_hostname", "ssh_username", "ssh_password"):
+            del credentials[credential]
+    return credentials
+
+
+@pytest.fixture(scope="session")
+def table_type(credentials) -> Callable[..., PostGresTable]:
+    return partial(PostGresTable, **credentials)
 
 
 @pytest.mark.postgres
-def test_table_creation(connection):
+def test_table_creation(cursor, credentials):
     table_name = "test_table_creation"
 
     fields = {
@@ -110,38 +201,142 @@ def test_table_creation(connection):
         "field_4": [str],
     }
 
-    with connection:
-        with connection.cursor() as cursor:
-            if database_has_table(cursor, table_name):
-                cursor.execute(f"DROP TABLE {table_name};")
+    drop_table(cursor, table_name)
 
     table = PostGresTable(
         table_name=table_name,
         fields=fields,
         primary_key="primary_key_field",
-        **CREDENTIALS["postgres"],
+        **credentials,
     )
 
     test_remote_fields = table.remote_fields
 
-    with connection:
-        with connection.cursor() as cursor:
-            test_raw_remote_fields = database_table_fields(cursor, table_name)
-            if table.exists:
-                table.delete_table()
-                table_exists = database_has_table(cursor, table_name)
-                if table_exists:
-                    cursor.execute(f"DROP TABLE {table_name};")
-
-    assert sorted(test_remote_fields) == sorted(fields)
-    assert sorted(test_raw_remote_fields) == sorted(fields)
+    test_raw_remote_fields = database_table_fields(cursor, table_name)
+    test_table_probe = database_table_probe(cursor, table_name)
+    if table.exists:
+        table.delete_table()
+        table_exists = database_has_table(cursor, table_name)
+        drop_table(cursor, table_name)
+
+    assert tuple(test_remote_fields) == tuple(fields)
+    assert tuple(test_raw_remote_fields) == tuple(fields)
+    assert test_table_probe == (True, test_raw_remote_fields)
     assert not table_exists
 
 
+@pytest.mark.postgres
+def test_connection_pool(cursor, credentials, table_names, monkeypatch):
+    table_name = "test_connection_pool"
+
+    fields = {"primary_key_field": int, "field_1": str}
+
+    connections = []
+
+    def connect(*args, **kwargs):
+        connection = psycopg2_connect(*args, **kwargs)
+        connections.append(connection)
+        return connection
+
+    borrowed = []
+    most_borrowed = 0
+
+    def getconn(pool, *args, **kwargs):
+        nonlocal most_borrowed
+        borrowed.append(pool_getconn(pool, *args, **kwargs))
+        most_borrowed = max(most_borrowed, len(borrowed))
+        return borrowed[-1]
+
+    def putconn(pool, connection, *args, **kwargs):
+        borrowed.remove(connection)
+        return pool_putconn(pool, connection, *args, **kwargs)
+
+    psycopg2_connect = psycopg2.connect
+    pool_getconn = ThreadedConnectionPool.getconn
+    pool_putconn = ThreadedConnectionPool.putconn
+    monkeypatch.setattr(psycopg2, "connect", connect)
+    monkeypatch.setattr(ThreadedConnectionPool, "getconn", getconn)
+    monkeypatch.setattr(ThreadedConnectionPool, "putconn", putconn)
+    monkeypatch.setattr(tablecrow.tables.postgres, "CONNECTION_POOLS", {})
+
+    drop_table(cursor, table_name)
+    table_names.append(table_name)
+
+    tables = [
+        PostGresTable(
+            table_name=table_name,
+            fields=fields,
+            primary_key="primary_key_field",
+            **credentials,
+        )
+        for _ in range(3)
+    ]
+    tables[0].insert([{"primary_key_field": 1, "field_1": "test 1"}])
+    test_records = tables[-1].records
+
+    test_closed_connections = [
+        connection for connection in connections if connection.closed
+    ]
+    tables[0].connection_pool.closeall()
+
+    # a table only ever borrows one connection at a time, and connections are kept for reuse once returned
+    assert most_borrowed == 1
+    assert len(connections) == CONNECTION_POOL_MINIMUM_SIZE
+    assert len(test_closed_connections) == 0
+    assert test_records == [{"primary_key_field": 1, "field_1": "test 1"}]
+
+
+@pytest.mark.postgres
+def test_close_connection_pools(cursor, credentials, table_names, monkeypatch):
+    table_name = "test_close_connection_pools"
+
+    fields = {"primary_key_field": int, "field_1": str}
+
+    monkeypatch.setattr(tablecrow.tables.postgres, "CONNECTION_POOLS", {})
+
+    drop_table(cursor, table_name)
+    table_names.append(table_name)
+
+    table = PostGresTable(
+        table_name=table_name,
+        fields=fields,
+        primary_key="primary_key_field",
+        **credentials,
+    )
+    table.insert([{"primary_key_field": 1, "field_1": "test 1"}])
+
+    pool = table.connection_pool
+    close_connection_pools()
+
+    test_closed_pool = pool.closed
+    test_open_pools = len(tablecrow.tables.postgres.CONNECTION_POOLS)
+
+    # the pool is reopened when the table is used again
+    test_records = table.records
+    table.connection_pool.closeall()
+
+    def getconn(pool, *args, **kwargs):
+        raise PoolError("connection pool exhausted")
+
+    monkeypatch.setattr(ThreadedConnectionPool, "getconn", getconn)
+
+    with pytest.raises(ConnectionError):
+        table.records
+
+    assert test_closed_pool
+    assert test_open_pools == 0
+    assert test_records == [{"primary_key_field": 1, "field_1": "test 1"}]
+    # pools are not keyed by the plain text password
+    assert all(
+        table._DatabaseTable__password not in key
+        for key in tablecrow.tables.postgres.CONNECTION_POOLS
+    )
+
+
 @pytest.mark.postgres
 @pytest.mark.spatial
-def test_table_creation_spatial(connection):
-    table_name = "test_table_creation"
+def test_table_creation_spatial(cursor, credentials):
+    table_name = "test_table_creation_spatial"
 
     fields = {
         "primary_key_field": int,
@@ -149,36 +344,30 @@ def test_table_creation_spatial(connection):
         "field_6": MultiPolygon,
     }
 
-    with connection:
-        with connection.cursor() as cursor:
-            if database_has_table(cursor, table_name):
-                cursor.execute(f"DROP TABLE {table_name};")
+    drop_table(cursor, table_name)
 
     table = PostGresTable(
         table_name=table_name,
         fields=fields,
         primary_key="primary_key_field",
-        **CREDENTIALS["postgres"],
+        **credentials,
     )
 
     test_remote_fields = table.remote_fields
 
-    with connection:
-        with connection.cursor() as cursor:
-            test_raw_remote_fields = database_table_fields(cursor, table_name)
-            if table.exists:
-                table.delete_table()
-                table_exists = database_has_table(cursor, table_name)
-                if table_exists:
-                    cursor.execute(f"DROP TABLE {table_name};")
-
-    assert sorted(test_remote_fields) == sorted(fields)
-    assert sorted(test_raw_remote_fields) == sorted(fields)
+    test_raw_remote_fields = database_table_fields(cursor, table_name)
+    if table.exists:
+        table.delete_table()
+        table_exists = database_has_table(cursor, table_name)
+        drop_table(cursor, table_name)
+
+    assert tuple(test_remote_fields) == tuple(fields)
+    assert tuple(test_raw_remote_fields) == tuple(fields)
     assert not table_exists
 
 
 @pytest.mark.postgres
-def test_compound_primary_key(connection):
+def test_compound_primary_key(cursor, empty_table):
     table_name = "test_compound_primary_key"
 
     fields = {
@@ -222,17 +411,7 @@ def test_compound_primary_key(connection):
 
     primary_key = ("primary_key_field_1", "primary_key_field_2", "primary_key_field_3")
 
-    with connection:
-        with connection.cursor() as cursor:
-            if database_has_table(cursor, table_name):
-                cursor.execute(f"DROP TABLE {table_name};")
-
-    table = PostGresTable(
-        table_name=table_name,
-        fields=fields,
-        primary_key=primary_key,
-        **CREDENTIALS["postgres"],
-    )
+    table = empty_table(table_name, fields, primary_key=primary_key)
 
     test_primary_key = primary_key
     table.insert(records)
@@ -247,20 +426,16 @@ def test_compound_primary_key(connection):
     test_record = table[1, "test 1", datetime(2020, 1, 1)]
     test_records = table.records
 
-    with connection:
-        with connection.cursor() as cursor:
-            test_raw_remote_fields = database_table_fields(cursor, table_name)
-            if database_has_table(cursor, table_name):
-                cursor.execute(f"DROP TABLE {table_name};")
+    test_raw_remote_fields = database_table_fields(cursor, table_name)
 
     assert test_primary_key == primary_key
     assert test_records == records + [extra_record]
     assert test_record == records[0]
-    assert sorted(test_raw_remote_fields) == sorted(fields)
+    assert tuple(test_raw_remote_fields) == tuple(fields)
 
 
 @pytest.mark.postgres
-def test_record_insertion(connection):
+def test_record_insertion(empty_table):
     table_name = "test_record_insertion"
 
     fields = {
@@ -282,19 +457,8 @@ def test_record_insertion(connection):
         "field_3": "test 3",
     }
 
-    with connection:
-        with connection.cursor() as cursor:
-            if database_has_table(cursor, table_name):
-                cursor.execute(f"DROP TABLE {table_name};")
-
-    table = PostGresTable(
-        table_name=table_name,
-        fields=fields,
-        primary_key="primary_key_field",
-        **CREDENTIALS["postgres"],
-    )
-    table.insert(records)
-    test_records_before_addition = table.records
+    table = empty_table(table_name, fields, primary_key="primary_key_field")
+    test_records_before_addition = table.insert(records)
     table[extra_record["primary_key_field"]] = extra_record
     test_records_after_addition = table.records
 
@@ -320,17 +484,133 @@ def test_record_insertion(connection):
 
     table.insert(records[0])
 
-    with connection:
-        with connection.cursor() as cursor:
-            cursor.execute(f"DROP TABLE {table_name};")
-
     assert test_records_before_addition == records
     assert test_records_after_addition == records + [extra_record]
     assert test_records_after_deletion == records
 
 
 @pytest.mark.postgres
-def test_table_flexibility(connection):
+def test_bulk_insertion(empty_table, monkeypatch):
+    table_name = "test_bulk_insertion"
+
+    fields = {"primary_key_field": int, "field_1": str}
+
+    records = [
+        {"primary_key_field": index, "field_1": f"test {index}"}
+        for index in range(2000)
+    ]
+    updated_records = [
+        {"primary_key_field": record["primary_key_field"], "field_1": "updated"}
+        for record in records
+    ]
+
+    table = empty_table(table_name, fields, primary_key="primary_key_field")
+
+    # count bulk loads, regardless of how many rows each one carries
+    loads = []
+
+    def counting_copy_rows(*args, **kwargs):
+        loads.append(args)
+        return copy_rows(*args, **kwargs)
+
+    monkeypatch.setattr("tablecrow.tables.postgres.copy_rows", counting_copy_rows)
+
+    test_inserted_records = table.insert(records)
+    test_updated_records = table.insert(updated_records)
+    test_records = table.records
+    test_existing_records = table.insert([{"primary_key_field": 0}])
+
+    assert len(loads) == 2
+    assert test_inserted_records == records
+    assert test_updated_records == updated_records
+    assert test_existing_records == updated_records[:1]
+    assert test_records == updated_records
+
+
+@pytest.mark.postgres
+def test_bulk_insertion_aware_datetimes(empty_table, monkeypatch):
+    table_name = "test_bulk_insertion_aware_datetimes"
+
+    fields = {"primary_key_field": int, "field_1": datetime}
+
+    value = datetime(2020, 1, 1, 12, tzinfo=timezone(timedelta(hours=5)))
+    records = [
+        {"primary_key_field": index, "field_1": value}
+        for index in range(COPY_THRESHOLD)
+    ]
+
+    table = empty_table(table_name, fields, primary_key="primary_key_field")
+
+    loads = []
+
+    def counting_copy_rows(*args, **kwargs):
+        loads.append(args)
+        return copy_rows(*args, **kwargs)
+
+    monkeypatch.setattr("tablecrow.tables.postgres.copy_rows", counting_copy_rows)
+
+    test_single_record = table.insert(records[:1])[0]
+    test_records = table.insert(records)
+
+    # aware values are stored the same way in a large batch as in a small one
+    assert len(loads) == 0
+    assert {record["field_1"] for record in test_records} == {
+        test_single_record["field_1"]
+    }
+
+
+@pytest.mark.postgres
+def test_copy_text():
+    assert copy_text(None) == "\\N"
+    assert copy_text(True) == "t"
+    assert copy_text(False) == "f"
+    assert copy_text(1) == "1"
+    assert copy_text(1.5) == "1.5"
+    assert copy_text(b"\x00\xff") == "\\\\x00ff"
+    assert copy_text(date(2020, 1, 2)) == "2020-01-02"
+    assert copy_text(datetime(2020, 1, 2, 3, 4, 5)) == "2020-01-02T03:04:05"
+    assert copy_text(time(3, 4, 5)) == "03:04:05"
+    assert copy_text("tab\tnewline\nreturn\rbackslash\\") == (
+        "tab\\tnewline\\nreturn\\rbackslash\\\\"
+    )
+
+
+@pytest.mark.postgres
+def test_insertion_without_unique_key(cursor, credentials, table_names):
+    table_name = "test_insertion_without_unique_key"
+
+    records = [
+        {"primary_key_field": 1, "field_1": "test 1"},
+        {"primary_key_field": 2, "field_1": "test 2"},
+    ]
+    updated_records = [
+        {"primary_key_field": 2, "field_1": "updated"},
+        {"primary_key_field": 3, "field_1": "test 3"},
+    ]
+
+    drop_table(cursor, table_name)
+    table_names.append(table_name)
+
+    # a table created elsewhere, without a constraint on its key
+    cursor.execute(
+        f"CREATE TABLE {table_name} (primary_key_field INTEGER, field_1 VARCHAR);"
+    )
+
+    table = PostGresTable(table_name=table_name, **credentials)
+
+    test_inserted_records = table.insert(records)
+    test_updated_records = table.insert(updated_records)
+    test_existing_records = table.insert([{"primary_key_field": 1}])
+    test_records = sorted(table.records, key=lambda record: record["primary_key_field"])
+
+    assert test_inserted_records == records
+    assert test_updated_records == updated_records
+    assert test_existing_records == records[:1]
+    assert test_records == [records[0], *updated_records]
+
+
+@pytest.mark.postgres
+def test_table_flexibility(cursor, credentials, table_names):
     table_name = "test_table_flexibility"
 
     fields = {
@@ -346,85 +626,156 @@ def test_table_flexibility(connection):
         {"primary_key_field": 1, "field_1": datetime(2020, 1, 1), "field_3": "test 1"}
     ]
 
-    with connection:
-        with connection.cursor() as cursor:
-            if database_has_table(cursor, table_name):
-                cursor.execute(f"DROP TABLE {table_name};")
+    # fields missing from the table at the time of insertion are not stored
+    incomplete_record = {field: records[0][field] for field in incomplete_fields}
+    complete_record = {field: incomplete_record.get(field) for field in fields}
+
+    drop_table(cursor, table_name)
+    table_names.append(table_name)
 
     # create table with incomplete fields
     incomplete_table = PostGresTable(
         table_name=table_name,
         fields=incomplete_fields,
         primary_key="primary_key_field",
-        **CREDENTIALS["postgres"],
+        **credentials,
     )
-    incomplete_table.insert(records)
-    incomplete_records = incomplete_table.records
+    incomplete_records = incomplete_table.insert(records)
 
-    with connection:
-        with connection.cursor() as cursor:
-            database_table_fields(cursor, table_name)
+    database_table_fields(cursor, table_name)
 
     # create table with complete fields, pointing to existing remote table with incomplete fields
     complete_table = PostGresTable(
         table_name=table_name,
         fields=fields,
         primary_key="primary_key_field",
-        **CREDENTIALS["postgres"],
+        **credentials,
     )
     complete_records = complete_table.records
 
-    with connection:
-        with connection.cursor() as cursor:
-            test_complete_remote_fields = database_table_fields(cursor, table_name)
+    test_complete_remote_fields = database_table_fields(cursor, table_name)
 
     # create table with incomplete fields, pointing to existing remote table with complete fields
     completed_table = PostGresTable(
         table_name=table_name,
         fields=incomplete_fields,
         primary_key="primary_key_field",
-        **CREDENTIALS["postgres"],
+        **credentials,
     )
     completed_records = completed_table.records
 
-    with connection:
-        with connection.cursor() as cursor:
-            test_completed_remote_fields = database_table_fields(cursor, table_name)
-            cursor.execute(f"DROP TABLE {table_name};")
+    test_completed_remote_fields = database_table_fields(cursor, table_name)
 
-    assert sorted(test_complete_remote_fields) == sorted(fields)
-    assert sorted(test_completed_remote_fields) == sorted(fields)
+    assert tuple(test_complete_remote_fields) == tuple(fields)
+    assert tuple(test_completed_remote_fields) == tuple(fields)
 
-    for test_records in (incomplete_records, complete_records, completed_records):
-        for record_index, record in enumerate(test_records):
-            record = records[record_index]
-            for field, value in record.items():
-                assert value == record[field]
+    assert incomplete_records == [incomplete_record]
+    assert complete_records == [complete_record]
+    assert completed_records == [complete_record]
 
 
 @pytest.mark.postgres
-def test_list_type(connection):
-    table_name = "test_list_type"
+def test_appended_fields(cursor, credentials, table_names):
+    table_name = "test_appended_fields"
 
-    fields = {"primary_key_field": int, "field_1": [str], "field_2": tuple([str])}
+    fields = {"primary_key_field": int, "field_1": str}
+    appended_fields = {**fields, "field_2": float, "field_3": date}
+
+    records = [{"primary_key_field": 1, "field_1": "test 1"}]
+
+    drop_table(cursor, table_name)
+    table_names.append(table_name)
+
+    table = PostGresTable(
+        table_name=table_name,
+        fields=fields,
+        primary_key="primary_key_field",
+        **credentials,
+    )
+    table.insert(records)
+
+    cursor.execute("SELECT to_regclass(%s)::oid;", [table_name])
+    table_oid = cursor.fetchone()[0]
+
+    appended_table = PostGresTable(
+        table_name=table_name,
+        fields=appended_fields,
+        primary_key="primary_key_field",
+        **credentials,
+    )
+
+    cursor.execute("SELECT to_regclass(%s)::oid;", [table_name])
+    test_table_oid = cursor.fetchone()[0]
+
+    test_remote_fields = database_table_fields(cursor, table_name)
+
+    # fields appended after the existing ones are added without copying the table
+    assert test_table_oid == table_oid
+    assert tuple(test_remote_fields) == tuple(appended_fields)
+    assert appended_table.records == [
+        {"primary_key_field": 1, "field_1": "test 1", "field_2": None, "field_3": None}
+    ]
+
+
+@pytest.mark.postgres
+def test_appended_fields_with_new_primary_key(cursor, credentials, table_names):
+    table_name = "test_appended_fields_with_new_primary_key"
+
+    fields = {"primary_key_field": int, "field_1": str}
+    appended_fields = {**fields, "field_2": float}
 
     records = [
-        {"primary_key_field": 1, "field_1": ["test 1", "test 2"]},
-        {"primary_key_field": 2, "field_1": ["test 3", "test 1"]},
-        {"primary_key_field": 3, "field_2": ("test 1", "test 2")},
+        {"primary_key_field": 1, "field_1": "test 1"},
+        {"primary_key_field": 2, "field_1": "test 2"},
     ]
+    updated_record = {"primary_key_field": 2, "field_1": "test 2", "field_2": 5.67}
 
-    with connection:
-        with connection.cursor() as cursor:
-            if database_has_table(cursor, table_name):
-                cursor.execute(f"DROP TABLE {table_name};")
+    drop_table(cursor, table_name)
+    table_names.append(table_name)
 
     table = PostGresTable(
         table_name=table_name,
         fields=fields,
+        primary_key="field_1",
+        **credentials,
+    )
+    table.insert(records)
+
+    appended_table = PostGresTable(
+        table_name=table_name,
+        fields=appended_fields,
         primary_key="primary_key_field",
-        **CREDENTIALS["postgres"],
+        **credentials,
+    )
+    appended_table.insert([updated_record])
+
+    test_remote_fields = database_table_fields(cursor, table_name)
+    test_has_unique_key = database_table_has_unique_key(
+        cursor, table_name, ["primary_key_field"]
     )
+    test_records = sorted(
+        appended_table.records, key=lambda record: record["primary_key_field"]
+    )
+
+    # the table is rebuilt with the new primary key
+    assert tuple(test_remote_fields) == tuple(appended_fields)
+    assert test_has_unique_key
+    assert test_records == [{**records[0], "field_2": None}, updated_record]
+
+
+@pytest.mark.postgres
+def test_list_type(empty_table):
+    table_name = "test_list_type"
+
+    fields = {"primary_key_field": int, "field_1": [str], "field_2": tuple([str])}
+
+    records = [
+        {"primary_key_field": 1, "field_1": ["test 1", "test 2"]},
+        {"primary_key_field": 2, "field_1": ["test 3", "test 1"]},
+        {"primary_key_field": 3, "field_2": ("test 1", "test 2")},
+    ]
+
+    table = empty_table(table_name, fields, primary_key="primary_key_field")
 
     table.insert(records)
 
@@ -433,10 +784,6 @@ def test_list_type(connection):
     test_record_query_1 = table.records_where("'test 1' = ANY(field_1)")
     test_record_query_2 = table.records_where({"field_1": "test 1"})
 
-    with connection:
-        with connection.cursor() as cursor:
-            cursor.execute(f"DROP TABLE {table_name};")
-
     records[0]["field_2"] = ()
     records[1]["field_2"] = ()
     records[2]["field_1"] = []
@@ -447,7 +794,7 @@ def test_list_type(connection):
 
 
 @pytest.mark.postgres
-def test_records_where(connection):
+def test_records_where(empty_table):
     table_name = "test_records_where"
 
     fields = {"primary_key_field": int, "field_1": datetime, "field_2": str}
@@ -459,17 +806,7 @@ def test_records_where(connection):
         {"primary_key_field": 4, "field_1": datetime(2020, 1, 4), "field_2": None},
     ]
 
-    with connection:
-        with connection.cursor() as cursor:
-            if database_has_table(cursor, table_name):
-                cursor.execute(f"DROP TABLE {table_name};")
-
-    table = PostGresTable(
-        table_name=table_name,
-        fields=fields,
-        primary_key="primary_key_field",
-        **CREDENTIALS["postgres"],
-    )
+    table = empty_table(table_name, fields, primary_key="primary_key_field")
 
     table.insert(records)
 
@@ -482,6 +819,25 @@ def test_records_where(connection):
         ["field_1 = '2020-01-02'", "field_2 IN ('test 1', 'test 2')"]
     )
     test_record_query_7 = table.records_where({"field_2": None})
+    # values are converted to the type of the field they are compared with
+    test_record_query_8 = table.records_where({"primary_key_field": ["1", "3"]})
+    test_record_query_9 = table.records_where(
+        {"field_1": ["2020-01-02T00:00:00", "2020-01-03"]}
+    )
+    test_repeated_record_query = table.records_where({"field_2": ["test 1", "test 3"]})
+    test_record_queries = table.records_where_many(
+        [
+            {"field_1": datetime(2020, 1, 1)},
+            {"field_2": ["test 1", "test 3"]},
+            {"primary_key_field": range(3)},
+            {"field_2": "test%"},
+            "field_1 = '2020-01-02'",
+            ["field_1 = '2020-01-02'", "field_2 IN ('test 1', 'test 2')"],
+            {"field_2": None},
+            "field_2 LIKE 'test%'",
+            None,
+        ]
+    )
 
     with pytest.raises(KeyError):
         table.records_where("nonexistent_field = 4")
@@ -493,12 +849,9 @@ def test_records_where(connection):
         table.records_where(1)
 
     table.delete_where({"field_1": datetime(2020, 1, 1)})
+    table.delete_where({"primary_key_field": ["4"]})
     test_records_after_deletion = table.records
 
-    with connection:
-        with connection.cursor() as cursor:
-            cursor.execute(f"DROP TABLE {table_name};")
-
     assert test_record_query_1 == [records[0]]
     assert test_record_query_2 == [records[0], records[2]]
     assert test_record_query_3 == records[:2]
@@ -506,11 +859,56 @@ def test_records_where(connection):
     assert test_record_query_5 == [records[1]]
     assert test_record_query_6 == [records[1]]
     assert test_record_query_7 == [records[3]]
-    assert test_records_after_deletion == records[1:]
+    assert test_record_query_8 == [records[0], records[2]]
+    assert test_record_query_9 == records[1:3]
+    assert test_repeated_record_query == test_record_query_2
+    assert test_record_queries == [
+        test_record_query_1,
+        test_record_query_2,
+        test_record_query_3,
+        test_record_query_4,
+        test_record_query_5,
+        test_record_query_6,
+        test_record_query_7,
+        records[:3],
+        records,
+    ]
+    assert test_records_after_deletion == records[1:3]
+
+
+@pytest.mark.postgres
+def test_records_where_recreated_table(cursor, credentials, table_names):
+    table_name = "test_records_where_recreated_table"
+
+    drop_table(cursor, table_name)
+    table_names.append(table_name)
+
+    table = PostGresTable(
+        table_name=table_name,
+        fields={"primary_key_field": int, "field_1": int},
+        primary_key="primary_key_field",
+        **credentials,
+    )
+    table.insert([{"primary_key_field": 1, "field_1": 1}])
+    test_records = table.records_where({"primary_key_field": 1})
+    table.delete_table()
+
+    # the same query is prepared again once the type of one of its columns changes
+    recreated_table = PostGresTable(
+        table_name=table_name,
+        fields={"primary_key_field": int, "field_1": str},
+        primary_key="primary_key_field",
+        **credentials,
+    )
+    recreated_table.insert([{"primary_key_field": 1, "field_1": "test 1"}])
+    test_recreated_records = recreated_table.records_where({"primary_key_field": 1})
+
+    assert test_records == [{"primary_key_field": 1, "field_1": 1}]
+    assert test_recreated_records == [{"primary_key_field": 1, "field_1": "test 1"}]
 
 
 @pytest.mark.postgres
-def test_field_reorder(connection):
+def test_field_reorder(cursor, credentials, table_names):
     table_name = "test_field_reorder"
 
     fields = {
@@ -538,49 +936,40 @@ def test_field_reorder(connection):
         }
     ]
 
-    with connection:
-        with connection.cursor() as cursor:
-            if database_has_table(cursor, table_name):
-                cursor.execute(f"DROP TABLE {table_name};")
+    drop_table(cursor, table_name)
+    table_names.append(table_name)
 
     table = PostGresTable(
         table_name=table_name,
         fields=fields,
         primary_key="primary_key_field",
-        **CREDENTIALS["postgres"],
+        **credentials,
     )
-    table.insert(records)
-    test_records = table.records
+    test_records = table.insert(records)
 
-    with connection:
-        with connection.cursor() as cursor:
-            test_fields = database_table_fields(cursor, table_name)
+    test_fields = database_table_fields(cursor, table_name)
 
     reordered_table = PostGresTable(
         table_name=table_name,
         fields=reordered_fields,
         primary_key="primary_key_field",
-        **CREDENTIALS["postgres"],
+        **credentials,
     )
     test_reordered_records = reordered_table.records
 
-    with connection:
-        with connection.cursor() as cursor:
-            test_reordered_fields = database_table_fields(cursor, table_name)
-            cursor.execute(f"DROP TABLE {table_name};")
+    test_reordered_fields = database_table_fields(cursor, table_name)
 
-    assert sorted(test_fields) == sorted(fields)
-    assert sorted(test_reordered_fields) == sorted(reordered_fields)
+    assert tuple(test_fields) == tuple(fields)
+    assert tuple(test_reordered_fields) == tuple(reordered_fields)
 
-    for test_records in (test_records, test_reordered_records):
-        for record_index, record in enumerate(records):
-            test_record = test_records[record_index]
-            for field, value in record.items():
-                assert test_record[field] == value
+    records[0]["field_2"] = None
+
+    assert test_records == records
+    assert test_reordered_records == records
 
 
 @pytest.mark.postgres
-def test_nonexistent_field_in_inserted_record(connection):
+def test_nonexistent_field_in_inserted_record(empty_table):
     table_name = "test_nonexistent_field_in_inserted_record"
 
     fields = {
@@ -596,24 +985,10 @@ def test_nonexistent_field_in_inserted_record(connection):
         "nonexistent_field": "test",
     }
 
-    with connection:
-        with connection.cursor() as cursor:
-            if database_has_table(cursor, table_name):
-                cursor.execute(f"DROP TABLE {table_name};")
-
-    table = PostGresTable(
-        table_name=table_name,
-        fields=fields,
-        primary_key="primary_key_field",
-        **CREDENTIALS["postgres"],
-    )
+    table = empty_table(table_name, fields, primary_key="primary_key_field")
     table[record_with_extra_field["primary_key_field"]] = record_with_extra_field
     test_records = table.records
 
-    with connection:
-        with connection.cursor() as cursor:
-            cursor.execute(f"DROP TABLE {table_name};")
-
     del record_with_extra_field["nonexistent_field"]
     record_with_extra_field["field_2"] = None
     record_with_extra_field["field_3"] = None
@@ -623,7 +998,7 @@ def test_nonexistent_field_in_inserted_record(connection):
 
 @pytest.mark.postgres
 @pytest.mark.spatial
-def test_missing_crs(connection):
+def test_missing_crs(empty_table):
     table_name = "test_missing_crs"
 
     fields = {
@@ -633,20 +1008,14 @@ def test_missing_crs(connection):
         "field_3": MultiPolygon,
     }
 
-    table = PostGresTable(
-        table_name=table_name,
-        fields=fields,
-        primary_key="primary_key_field",
-        crs=None,
-        **CREDENTIALS["postgres"],
-    )
+    table = empty_table(table_name, fields, primary_key="primary_key_field", crs=None)
 
     assert table.crs == DEFAULT_CRS
 
 
 @pytest.mark.postgres
 @pytest.mark.spatial
-def test_records_intersecting_polygon(connection):
+def test_records_intersecting_polygon(empty_table):
     table_name = "test_records_intersecting_polygon"
 
     fields = {
@@ -656,70 +1025,25 @@ def test_records_intersecting_polygon(connection):
         "field_3": MultiPolygon,
     }
 
-    crs = CRS.from_epsg(4326)
-
-    inside_polygon = box(-77.7, 39.725, -77.4, 39.8)
-    touching_polygon = box(-77.1, 39.575, -76.8, 39.65)
-    outside_polygon = box(-77.7, 39.425, -77.4, 39.5)
-    containing_polygon = box(-77.7, 39.65, -77.1, 39.8)
-    projected_containing_polygon = box(268397.8, 4392279.8, 320292.0, 4407509.6)
-    multipolygon = MultiPolygon([inside_polygon, touching_polygon])
-
-    records = [
-        {
-            "primary_key_field": 1,
-            "field_1": "inside box",
-            "field_2": MultiPolygon([inside_polygon]),
-            "field_3": None,
-        },
-        {
-            "primary_key_field": 2,
-            "field_1": "containing box",
-            "field_2": MultiPolygon([containing_polygon]),
-            "field_3": None,
-        },
-        {
-            "primary_key_field": 3,
-            "field_1": "outside box with multipolygon",
-            "field_2": MultiPolygon([outside_polygon]),
-            "field_3": multipolygon,
-        },
-    ]
-
-    with connection:
-        with connection.cursor() as cursor:
-            if database_has_table(cursor, table_name):
-                cursor.execute(f"DROP TABLE {table_name};")
-
-    table = PostGresTable(
-        table_name=table_name,
-        fields=fields,
-        primary_key="primary_key_field",
-        crs=crs,
-        **CREDENTIALS["postgres"],
-    )
-    table.insert(records)
+    table = empty_table(table_name, fields, primary_key="primary_key_field", crs=WGS84)
+    table.insert(INTERSECTING_RECORDS)
 
-    test_query_1 = table.records_intersecting(inside_polygon)
-    test_query_2 = table.records_intersecting(containing_polygon)
+    test_query_1 = table.records_intersecting(INSIDE_POLYGON)
+    test_query_2 = table.records_intersecting(CONTAINING_POLYGON)
     test_query_3 = table.records_intersecting(
-        inside_polygon, geometry_fields=["field_2"]
+        INSIDE_POLYGON, geometry_fields=["field_2"]
     )
     test_query_4 = table.records_intersecting(
-        containing_polygon, geometry_fields=["field_2"]
+        CONTAINING_POLYGON, geometry_fields=["field_2"]
     )
     test_query_5 = table.records_intersecting(
-        projected_containing_polygon,
-        crs=CRS.from_epsg(32618),
+        PROJECTED_CONTAINING_POLYGON,
+        crs=UTM_18N,
         geometry_fields=["field_2"],
     )
 
-    with connection:
-        with connection.cursor() as cursor:
-            cursor.execute(f"DROP TABLE {table_name};")
-
-    assert test_query_1 == records
-    assert test_query_2 == records
-    assert test_query_3 == records[:2]
-    assert test_query_4 == records[:2]
-    assert test_query_5 == records[:2]
+    assert test_query_1 == INTERSECTING_RECORDS
+    assert test_query_2 == INTERSECTING_RECORDS
+    assert test_query_3 == INTERSECTING_RECORDS[:2]
+    assert test_query_4 == INTERSECTING_RECORDS[:2]
+    assert test_query_5 == INTERSECTING_RECORDS[:2]
@@ -1,6 +1,9 @@
 from datetime import date, datetime
+from functools import partial
+from operator import itemgetter
 import os
 import sqlite3
+from typing import Any, Callable, Dict, List
 
 import pytest
 from shapely.geometry import box, MultiPolygon, Point
@@ -8,7 +11,11 @@ from pyproj import CRS
 
 from tablecrow import SQLiteTable
 from tablecrow.tables.base import DEFAULT_CRS
-from tablecrow.tables.sqlite import database_has_table, database_table_fields
+from tablecrow.tables.sqlite import (
+    database_has_table,
+    database_table_fields,
+    database_table_probe,
+)
 from tablecrow.utilities import read_configuration, repository_root
 
 CREDENTIALS_FILENAME = repository_root() / "credentials.config"
@@ -17,75 +24,120 @@ CREDENTIALS = read_configuration(CREDENTIALS_FILENAME)
 if "sqlite" not in CREDENTIALS:
     CREDENTIALS["sqlite"] = {}
 
+# a shared in-memory database lives as long as any connection to it, and never touches the disk
 default_credentials = {
-    "path": ("SQLITE_DATABASE", "test_database.db"),
+    "path": ("SQLITE_DATABASE", "file:tablecrow_test?mode=memory&cache=shared"),
 }
 
 for credential, details in default_credentials.items():
     if credential not in CREDENTIALS["sqlite"]:
         CREDENTIALS["sqlite"][credential] = os.getenv(*details)
 
+WGS84 = CRS.from_epsg(4326)
+
+INSIDE_POLYGON = box(-77.7, 39.725, -77.4, 39.8)
+TOUCHING_POLYGON = box(-77.1, 39.575, -76.8, 39.65)
+OUTSIDE_POLYGON = box(-77.7, 39.425, -77.4, 39.5)
+CONTAINING_POLYGON = box(-77.7, 39.65, -77.1, 39.8)
+# PROJECTED_CONTAINING_POLYGON = box(268397.8, 4392279.8, 320292.0, 4407509.6)
+MULTIPOLYGON = MultiPolygon([INSIDE_POLYGON, TOUCHING_POLYGON])
+
+INTERSECTING_RECORDS = [
+    {
+        "primary_key_field": 1,
+        "field_1": "inside box",
+        "field_2": MultiPolygon([INSIDE_POLYGON]),
+        "field_3": None,
+    },
+    {
+        "primary_key_field": 2,
+        "field_1": "containing box",
+        "field_2": MultiPolygon([CONTAINING_POLYGON]),
+        "field_3": None,
+    },
+    {
+        "primary_key_field": 3,
+        "field_1": "outside box with multipolygon",
+        "field_2": MultiPolygon([OUTSIDE_POLYGON]),
+        "field_3": MULTIPOLYGON,
+    },
+]
 
-def sqlite_connection() -> sqlite3.Connection:
-    return sqlite3.connect(CREDENTIALS["sqlite"]["path"])
 
+def sorted_by_primary_key(
+    records: List[Dict[str, Any]], primary_key: str = "primary_key_field"
+) -> List[Dict[str, Any]]:
+    # rows are returned in no particular order without an ORDER BY
+    return sorted(records, key=itemgetter(primary_key))
 
-@pytest.mark.sqlite
-def test_table_creation():
-    table_name = "test_table_creation"
 
-    fields = {
-        "primary_key_field": int,
-        "field_1": str,
-        "field_2": float,
-        "field_3": datetime,
-        "field_4": date,
-        "field_5": bool,
-    }
+def drop_table(cursor: sqlite3.Cursor, table: str):
+    cursor.execute(f"DROP TABLE IF EXISTS {table};")
 
-    with sqlite_connection() as connection:
-        cursor = connection.cursor()
-        if database_has_table(cursor, table_name):
-            cursor.execute(f"DROP TABLE {table_name};")
 
-    table = SQLiteTable(
-        table_name=table_name,
-        fields=fields,
-        primary_key="primary_key_field",
-        **CREDENTIALS["sqlite"],
+@pytest.fixture(scope="session")
+def connection() -> sqlite3.Connection:
+    # commit each statement as it is sent
+    connection = sqlite3.connect(
+        CREDENTIALS["sqlite"]["path"], isolation_level=None, uri=True
+    )
+    # the test database is disposable, so trade durability for fewer syncs to disk
+    connection.executescript(
+        "PRAGMA synchronous = OFF;"
+        "PRAGMA journal_mode = MEMORY;"
+        "PRAGMA temp_store = MEMORY;"
+        "PRAGMA cache_size = -65536;"
     )
 
-    test_remote_fields = table.remote_fields
+    yield connection
 
-    with sqlite_connection() as connection:
-        cursor = connection.cursor()
-        test_raw_remote_fields = database_table_fields(cursor, table_name)
-        if table.exists:
-            table.delete_table()
-            table_exists = database_has_table(cursor, table_name)
-            if table_exists:
-                cursor.execute(f"DROP TABLE {table_name};")
+    connection.close()
 
-    assert test_remote_fields == fields
-    assert list(test_raw_remote_fields) == list(fields)
-    assert not table_exists
 
+@pytest.fixture(scope="session")
+def cursor(connection) -> sqlite3.Cursor:
+    cursor = connection.cursor()
 
-@pytest.mark.sqlite
-@pytest.mark.spatial
-def test_table_creation_spatial():
-    table_name = "test_table_creation"
+    yield cursor
+
+    cursor.close()
 
-    fields = {
-        "primary_key_field": int,
-        "field_6": Point,
-        "field_7": MultiPolygon,
-    }
 
-    with sqlite_connection() as connection:
-        cursor = connection.cursor()
-        if database_has_table(cursor, table_name):
-            cursor.execute(f"DROP TABLE {table_name};")
+@pytest.fixture(scope="session")
+def table_type() -> Callable[..., SQLiteTable]:
+    return partial(SQLiteTable, **CREDENTIALS["sqlite"])
+
+
+@pytest.mark.sqlite
+@pytest.mark.parametrize(
+    "table_name,fields",
+    [
+        pytest.param(
+            "test_table_creation",
+            {
+                "primary_key_field": int,
+                "field_1": str,
+                "field_2": float,
+                "field_3": datetime,
+                "field_4": date,
+                "field_5": bool,
+            },
+            id="tabular",
+        ),
+        pytest.param(
+            "test_table_creation_spatial",
+            {
+                "primary_key_field": int,
+                "field_6": Point,
+                "field_7": MultiPolygon,
+            },
+            marks=pytest.mark.spatial,
+            id="spatial",
+        ),
+    ],
+)
+def test_table_creation(cursor, table_name, fields):
+    drop_table(cursor, table_name)
 
     table = SQLiteTable(
         table_name=table_name,
@@ -96,22 +148,22 @@ def test_table_creation_spatial():
 
     test_remote_fields = table.remote_fields
 
-    with sqlite_connection() as connection:
-        cursor = connection.cursor()
-        test_raw_remote_fields = database_table_fields(cursor, table_name)
-        if table.exists:
-            table.delete_table()
-            table_exists = database_has_table(cursor, table_name)
-            if table_exists:
-                cursor.execute(f"DROP TABLE {table_name};")
+    test_raw_remote_fields = database_table_fields(cursor, table_name)
+    test_table_probe = database_table_probe(cursor, table_name)
+    if table.exists:
+        table.delete_table()
+        table_exists = database_has_table(cursor, table_name)
+        drop_table(cursor, table_name)
 
     assert test_remote_fields == fields
-    assert list(test_raw_remote_fields) == list(fields)
+    assert tuple(test_raw_remote_fields) == tuple(fields)
+    assert test_table_probe == (True, test_raw_remote_fields)
     assert not table_exists
+    assert database_table_probe(cursor, table_name) == (False, {})
 
 
 @pytest.mark.sqlite
-def test_compound_primary_key():
+def test_compound_primary_key(cursor, empty_table):
     table_name = "test_compound_primary_key"
 
     fields = {
@@ -155,45 +207,36 @@ def test_compound_primary_key():
 
     primary_key = ("primary_key_field_1", "primary_key_field_2", "primary_key_field_3")
 
-    with sqlite_connection() as connection:
-        cursor = connection.cursor()
-        if database_has_table(cursor, table_name):
-            cursor.execute(f"DROP TABLE {table_name};")
-
-    table = SQLiteTable(
-        table_name=table_name,
-        fields=fields,
-        primary_key=primary_key,
-        **CREDENTIALS["sqlite"],
-    )
+    table = empty_table(table_name, fields, primary_key=primary_key)
 
     test_primary_key = primary_key
-    table.insert(records)
 
-    with pytest.raises(ValueError):
-        table[1]
-    with pytest.raises(IndexError):
-        table[1] = extra_record_to_insert
+    # commit every operation at once
+    with table.transaction():
+        table.insert(records)
 
-    table[3, "test 3", datetime(2020, 1, 3)] = extra_record_to_insert
+        with pytest.raises(ValueError):
+            table[1]
+        with pytest.raises(IndexError):
+            table[1] = extra_record_to_insert
 
-    test_record = table[1, "test 1", datetime(2020, 1, 1)]
-    test_records = table.records
+        table[3, "test 3", datetime(2020, 1, 3)] = extra_record_to_insert
+
+        test_record = table[1, "test 1", datetime(2020, 1, 1)]
+        test_records = table.records
 
-    with sqlite_connection() as connection:
-        cursor = connection.cursor()
-        test_raw_remote_fields = database_table_fields(cursor, table_name)
-        if database_has_table(cursor, table_name):
-            cursor.execute(f"DROP TABLE {table_name};")
+    test_raw_remote_fields = database_table_fields(cursor, table_name)
 
     assert test_primary_key == primary_key
-    assert test_records == records + [extra_record]
+    assert sorted_by_primary_key(test_records, "primary_key_field_1") == records + [
+        extra_record
+    ]
     assert test_record == records[0]
-    assert list(test_raw_remote_fields) == list(fields)
+    assert tuple(test_raw_remote_fields) == tuple(fields)
 
 
 @pytest.mark.sqlite
-def test_record_insertion():
+def test_record_insertion(empty_table):
     table_name = "test_record_insertion"
 
     fields = {
@@ -227,17 +270,7 @@ def test_record_insertion():
         "field_4": False,
     }
 
-    with sqlite_connection() as connection:
-        cursor = connection.cursor()
-        if database_has_table(cursor, table_name):
-            cursor.execute(f"DROP TABLE {table_name};")
-
-    table = SQLiteTable(
-        table_name=table_name,
-        fields=fields,
-        primary_key="primary_key_field",
-        **CREDENTIALS["sqlite"],
-    )
+    table = empty_table(table_name, fields, primary_key="primary_key_field")
     table.insert(records)
     test_records_before_addition = table.records
     table[extra_record["primary_key_field"]] = extra_record
@@ -265,17 +298,157 @@ def test_record_insertion():
 
     table.insert(records[0])
 
-    with sqlite_connection() as connection:
-        cursor = connection.cursor()
-        cursor.execute(f"DROP TABLE {table_name};")
+    assert sorted_by_primary_key(test_records_before_addition) == records
+    assert sorted_by_primary_key(test_records_after_addition) == records + [
+        extra_record
+    ]
+    assert sorted_by_primary_key(test_records_after_deletion) == records
+
+
+@pytest.mark.sqlite
+def test_failed_lookup(empty_table, monkeypatch):
+    table_name = "test_failed_lookup"
+
+    fields = {"primary_key_field": int, "field_1": str}
+
+    table = empty_table(table_name, fields, primary_key="primary_key_field")
+    table.insert([{"primary_key_field": 1, "field_1": "test 1"}])
+
+    error = RuntimeError("failed query")
+
+    def records_where(where):
+        raise error
+
+    monkeypatch.setattr(table, "records_where", records_where)
+
+    # a failed query on a live connection is reported as a missing key, caused by the original error
+    with pytest.raises(KeyError) as test_error:
+        table[1]
+
+    assert test_error.value.__cause__ is error
+    assert 1 not in table
+
+
+@pytest.mark.sqlite
+def test_transaction(empty_table):
+    table_name = "test_transaction"
+
+    fields = {"primary_key_field": int, "field_1": str}
+
+    records = [
+        {"primary_key_field": 1, "field_1": "test 1"},
+        {"primary_key_field": 2, "field_1": "test 2"},
+    ]
+
+    table = empty_table(table_name, fields, primary_key="primary_key_field")
+
+    with table.transaction():
+        # reads before the first write are part of the transaction
+        test_records_before_insertion = table.records
+        test_in_transaction = table.connection.in_transaction
+        table.insert(records[:1])
+        table[2] = {"field_1": "test 2"}
+    test_committed_records = table.records
+
+    # an error within the transaction rolls back every operation in it
+    with pytest.raises(RuntimeError):
+        with table.transaction():
+            table.insert({"primary_key_field": 3, "field_1": "test 3"})
+            del table[1]
+            raise RuntimeError
+    test_rolled_back_records = table.records
+
+    assert test_records_before_insertion == []
+    assert test_in_transaction
+    assert not table.connection.in_transaction
+    assert sorted_by_primary_key(test_committed_records) == records
+    assert sorted_by_primary_key(test_rolled_back_records) == records
+
+
+@pytest.mark.sqlite
+@pytest.mark.parametrize("record_count", [1, 1000, 10000])
+def test_bulk_insertion(empty_table, record_count):
+    table_name = "test_bulk_insertion"
+
+    fields = {"primary_key_field": int, "field_1": str}
+
+    records = [
+        {"primary_key_field": index, "field_1": f"test {index}"}
+        for index in range(record_count)
+    ]
+    updated_records = [
+        {"primary_key_field": record["primary_key_field"], "field_1": "updated"}
+        for record in records
+    ]
+
+    table = empty_table(table_name, fields, primary_key="primary_key_field")
+
+    # records may be given as any iterable, including a generator
+    test_returned_records = table.insert(iter(records))
+    test_inserted_records = table.records
+    test_returned_updated_records = table.insert(updated_records)
+    test_updated_records = table.records
+    test_existing_records = table.insert([{"primary_key_field": 0}])
+    # keys are returned as the type of their field, even if given as another type
+    test_existing_records_by_string = table.insert([{"primary_key_field": "0"}])
+
+    assert test_returned_records == records
+    assert test_returned_updated_records == updated_records
+    assert test_existing_records == updated_records[:1]
+    assert test_existing_records_by_string == updated_records[:1]
+    assert sorted_by_primary_key(test_inserted_records) == records
+    assert sorted_by_primary_key(test_updated_records) == updated_records
+
+
+@pytest.mark.sqlite
+@pytest.mark.parametrize("upsert_sqlite_version", [None, (99, 0, 0)])
+def test_insertion_without_upsert(
+    cursor, table_names, monkeypatch, upsert_sqlite_version
+):
+    table_name = "test_insertion_without_upsert"
+
+    records = [
+        {"primary_key_field": 1, "field_1": "test 1"},
+        {"primary_key_field": 2, "field_1": "test 2"},
+    ]
+    updated_records = [
+        {"primary_key_field": 2, "field_1": "updated"},
+        {"primary_key_field": 3, "field_1": "test 3"},
+    ]
+
+    drop_table(cursor, table_name)
+    table_names.append(table_name)
+
+    if upsert_sqlite_version is None:
+        # a table created elsewhere, without a constraint on its key
+        cursor.execute(
+            f"CREATE TABLE {table_name} (primary_key_field INTEGER, field_1 TEXT);"
+        )
+    else:
+        monkeypatch.setattr(
+            "tablecrow.tables.sqlite.UPSERT_SQLITE_VERSION", upsert_sqlite_version
+        )
+
+    table = SQLiteTable(
+        table_name=table_name,
+        fields={"primary_key_field": int, "field_1": str},
+        primary_key="primary_key_field",
+        **CREDENTIALS["sqlite"],
+    )
+
+    test_inserted_records = table.insert(records)
+    test_updated_records = table.insert(updated_records)
+    test_existing_records = table.insert([{"primary_key_field": 1}])
+    test_records = sorted_by_primary_key(table.records)
 
-    assert test_records_before_addition == records
-    assert test_records_after_addition == records + [extra_record]
-    assert test_records_after_deletion == records
+    assert test_inserted_records == records
+    assert test_updated_records == updated_records
+    assert test_existing_records == records[:1]
+    assert test_records == [records[0], *updated_records]
 
 
 @pytest.mark.sqlite
-def test_table_flexibility():
+def test_table_flexibility(cursor, table_names):
     table_name = "test_table_flexibility"
 
     fields = {
@@ -291,10 +464,12 @@ def test_table_flexibility():
         {"primary_key_field": 1, "field_1": datetime(2020, 1, 1), "field_3": "test 1"}
     ]
 
-    with sqlite_connection() as connection:
-        cursor = connection.cursor()
-        if database_has_table(cursor, table_name):
-            cursor.execute(f"DROP TABLE {table_name};")
+    # fields missing from the table at the time of insertion are not stored
+    incomplete_record = {field: records[0][field] for field in incomplete_fields}
+    complete_record = {field: incomplete_record.get(field) for field in fields}
+
+    drop_table(cursor, table_name)
+    table_names.append(table_name)
 
     # create table with incomplete fields
     incomplete_table = SQLiteTable(
@@ -306,9 +481,7 @@ def test_table_flexibility():
     incomplete_table.insert(records)
     incomplete_records = incomplete_table.records
 
-    with sqlite_connection() as connection:
-        cursor = connection.cursor()
-        test_incomplete_remote_fields = database_table_fields(cursor, table_name)
+    test_incomplete_remote_fields = database_table_fields(cursor, table_name)
 
     # create table with complete fields, pointing to existing remote table with incomplete fields
     complete_table = SQLiteTable(
@@ -319,9 +492,7 @@ def test_table_flexibility():
     )
     complete_records = complete_table.records
 
-    with sqlite_connection() as connection:
-        cursor = connection.cursor()
-        test_complete_remote_fields = database_table_fields(cursor, table_name)
+    test_complete_remote_fields = database_table_fields(cursor, table_name)
 
     # create table with incomplete fields, pointing to existing remote table with complete fields
     completed_table = SQLiteTable(
@@ -332,24 +503,19 @@ def test_table_flexibility():
     )
     completed_records = completed_table.records
 
-    with sqlite_connection() as connection:
-        cursor = connection.cursor()
-        test_completed_remote_fields = database_table_fields(cursor, table_name)
-        cursor.execute(f"DROP TABLE {table_name};")
+    test_completed_remote_fields = database_table_fields(cursor, table_name)
 
-    assert list(test_incomplete_remote_fields) == list(incomplete_fields)
-    assert list(test_complete_remote_fields) == list(fields)
-    assert list(test_completed_remote_fields) == list(fields)
+    assert tuple(test_incomplete_remote_fields) == tuple(incomplete_fields)
+    assert tuple(test_complete_remote_fields) == tuple(fields)
+    assert tuple(test_completed_remote_fields) == tuple(fields)
 
-    for test_records in (incomplete_records, complete_records, completed_records):
-        for record_index, record in enumerate(test_records):
-            record = records[record_index]
-            for field, value in record.items():
-                assert value == record[field]
+    assert incomplete_records == [incomplete_record]
+    assert complete_records == [complete_record]
+    assert completed_records == [complete_record]
 
 
 @pytest.mark.sqlite
-def test_records_where():
+def test_records_where(empty_table):
     table_name = "test_records_where"
 
     fields = {"primary_key_field": int, "field_1": datetime, "field_2": str}
@@ -361,17 +527,7 @@ def test_records_where():
         {"primary_key_field": 4, "field_1": datetime(2020, 1, 4), "field_2": None},
     ]
 
-    with sqlite_connection() as connection:
-        cursor = connection.cursor()
-        if database_has_table(cursor, table_name):
-            cursor.execute(f"DROP TABLE {table_name};")
-
-    table = SQLiteTable(
-        table_name=table_name,
-        fields=fields,
-        primary_key="primary_key_field",
-        **CREDENTIALS["sqlite"],
-    )
+    table = empty_table(table_name, fields, primary_key="primary_key_field")
 
     table.insert(records)
 
@@ -384,6 +540,9 @@ def test_records_where():
         ["field_1 = '2020-01-02 00:00:00'", "field_2 IN ('test 1', 'test 2')"]
     )
     test_record_query_7 = table.records_where({"field_2": None})
+    test_record_queries = table.records_where_many(
+        [{"field_1": datetime(2020, 1, 1)}, {"field_2": None}]
+    )
 
     with pytest.raises(sqlite3.OperationalError):
         table.records_where("nonexistent_field = 4")
@@ -397,22 +556,23 @@ def test_records_where():
     table.delete_where({"field_1": datetime(2020, 1, 1)})
     test_records_after_deletion = table.records
 
-    with sqlite_connection() as connection:
-        cursor = connection.cursor()
-        cursor.execute(f"DROP TABLE {table_name};")
+    table.delete_where(None)
+    test_records_after_truncation = table.records
 
     assert test_record_query_1 == [records[0]]
-    assert test_record_query_2 == [records[0], records[2]]
-    assert test_record_query_3 == records[:2]
-    assert test_record_query_4 == records[:3]
+    assert sorted_by_primary_key(test_record_query_2) == [records[0], records[2]]
+    assert sorted_by_primary_key(test_record_query_3) == records[:2]
+    assert sorted_by_primary_key(test_record_query_4) == records[:3]
     assert test_record_query_5 == [records[1]]
     assert test_record_query_6 == [records[1]]
     assert test_record_query_7 == [records[3]]
-    assert test_records_after_deletion == records[1:]
+    assert test_record_queries == [test_record_query_1, test_record_query_7]
+    assert sorted_by_primary_key(test_records_after_deletion) == records[1:]
+    assert test_records_after_truncation == []
 
 
 @pytest.mark.sqlite
-def test_field_reorder():
+def test_field_reorder(cursor, table_names):
     table_name = "test_field_reorder"
 
     fields = {
@@ -440,10 +600,13 @@ def test_field_reorder():
         }
     ]
 
-    with sqlite_connection() as connection:
-        cursor = connection.cursor()
-        if database_has_table(cursor, table_name):
-            cursor.execute(f"DROP TABLE {table_name};")
+    # fields absent from an inserted record are read back as null
+    complete_records = [
+        {field: record.get(field) for field in fields} for record in records
+    ]
+
+    drop_table(cursor, table_name)
+    table_names.append(table_name)
 
     table = SQLiteTable(
         table_name=table_name,
@@ -454,9 +617,7 @@ def test_field_reorder():
     table.insert(records)
     test_records = table.records
 
-    with sqlite_connection() as connection:
-        cursor = connection.cursor()
-        test_fields = database_table_fields(cursor, table_name)
+    test_fields = database_table_fields(cursor, table_name)
 
     reordered_table = SQLiteTable(
         table_name=table_name,
@@ -465,24 +626,20 @@ def test_field_reorder():
         **CREDENTIALS["sqlite"],
     )
     test_reordered_records = reordered_table.records
+    test_date_query = reordered_table.records_where({"field_4": date(2020, 1, 2)})
 
-    with sqlite_connection() as connection:
-        cursor = connection.cursor()
-        test_reordered_fields = database_table_fields(cursor, table_name)
-        cursor.execute(f"DROP TABLE {table_name};")
+    test_reordered_fields = database_table_fields(cursor, table_name)
 
-    assert list(test_fields) == list(fields)
-    assert list(test_reordered_fields) == list(reordered_fields)
+    assert tuple(test_fields) == tuple(fields)
+    assert tuple(test_reordered_fields) == tuple(reordered_fields)
+    assert [record["primary_key_field"] for record in test_date_query] == [1]
 
-    for test_records in (test_records, test_reordered_records):
-        for record_index, record in enumerate(records):
-            test_record = test_records[record_index]
-            for field, value in record.items():
-                assert test_record[field] == value
+    assert test_records == complete_records
+    assert test_reordered_records == complete_records
 
 
 @pytest.mark.sqlite
-def test_nonexistent_field_in_inserted_record():
+def test_nonexistent_field_in_inserted_record(empty_table):
     table_name = "test_nonexistent_field_in_inserted_record"
 
     fields = {
@@ -498,24 +655,10 @@ def test_nonexistent_field_in_inserted_record():
         "nonexistent_field": "test",
     }
 
-    with sqlite_connection() as connection:
-        cursor = connection.cursor()
-        if database_has_table(cursor, table_name):
-            cursor.execute(f"DROP TABLE {table_name};")
-
-    table = SQLiteTable(
-        table_name=table_name,
-        fields=fields,
-        primary_key="primary_key_field",
-        **CREDENTIALS["sqlite"],
-    )
+    table = empty_table(table_name, fields, primary_key="primary_key_field")
     table[record_with_extra_field["primary_key_field"]] = record_with_extra_field
     test_records = table.records
 
-    with sqlite_connection() as connection:
-        cursor = connection.cursor()
-        cursor.execute(f"DROP TABLE {table_name};")
-
     del record_with_extra_field["nonexistent_field"]
     record_with_extra_field["field_1"] = f'{record_with_extra_field["field_1"]}'
     record_with_extra_field["field_2"] = None
@@ -524,6 +667,29 @@ def test_nonexistent_field_in_inserted_record():
     assert test_records == [record_with_extra_field]
 
 
+@pytest.mark.sqlite
+def test_in_memory_database():
+    table_name = "test_in_memory_database"
+
+    fields = {"primary_key_field": int, "field_1": str}
+
+    records = [
+        {"primary_key_field": 1, "field_1": "test 1"},
+        {"primary_key_field": 2, "field_1": None},
+    ]
+
+    table = SQLiteTable(
+        path=":memory:",
+        table_name=table_name,
+        fields=fields,
+        primary_key="primary_key_field",
+    )
+    table.insert(records)
+
+    assert table.database == ":memory:"
+    assert table.records == records
+
+
 @pytest.mark.sqlite
 @pytest.mark.spatial
 def test_missing_crs():
@@ -549,7 +715,7 @@ def test_missing_crs():
 
 @pytest.mark.sqlite
 @pytest.mark.spatial
-def test_records_intersecting_polygon():
+def test_records_intersecting_polygon(empty_table):
     table_name = "test_records_intersecting_polygon"
 
     fields = {
@@ -559,72 +725,28 @@ def test_records_intersecting_polygon():
         "field_3": MultiPolygon,
     }
 
-    crs = CRS.from_epsg(4326)
-
-    inside_polygon = box(-77.7, 39.725, -77.4, 39.8)
-    touching_polygon = box(-77.1, 39.575, -76.8, 39.65)
-    outside_polygon = box(-77.7, 39.425, -77.4, 39.5)
-    containing_polygon = box(-77.7, 39.65, -77.1, 39.8)
-    # projected_containing_polygon = box(268397.8, 4392279.8, 320292.0, 4407509.6)
-    multipolygon = MultiPolygon([inside_polygon, touching_polygon])
-
-    records = [
-        {
-            "primary_key_field": 1,
-            "field_1": "inside box",
-            "field_2": MultiPolygon([inside_polygon]),
-            "field_3": None,
-        },
-        {
-            "primary_key_field": 2,
-            "field_1": "containing box",
-            "field_2": MultiPolygon([containing_polygon]),
-            "field_3": None,
-        },
-        {
-            "primary_key_field": 3,
-            "field_1": "outside box with multipolygon",
-            "field_2": MultiPolygon([outside_polygon]),
-            "field_3": multipolygon,
-        },
-    ]
-
-    with sqlite_connection() as connection:
-        cursor = connection.cursor()
-        if database_has_table(cursor, table_name):
-            cursor.execute(f"DROP TABLE {table_name};")
+    table = empty_table(table_name, fields, primary_key="primary_key_field", crs=WGS84)
+    test_inserted_records = table.insert(INTERSECTING_RECORDS)
 
-    table = SQLiteTable(
-        table_name=table_name,
-        fields=fields,
-        primary_key="primary_key_field",
-        crs=crs,
-        **CREDENTIALS["sqlite"],
-    )
-    table.insert(records)
-
-    test_query_1 = table.records_intersecting(inside_polygon)
-    test_query_2 = table.records_intersecting(containing_polygon)
+    test_query_1 = table.records_intersecting(INSIDE_POLYGON)
+    test_query_2 = table.records_intersecting(CONTAINING_POLYGON)
     test_query_3 = table.records_intersecting(
-        inside_polygon, geometry_fields=["field_2"]
+        INSIDE_POLYGON, geometry_fields=["field_2"]
     )
     test_query_4 = table.records_intersecting(
-        containing_polygon, geometry_fields=["field_2"]
+        CONTAINING_POLYGON, geometry_fields=["field_2"]
     )
 
     # TODO fix SRID transformation from 32618
     # test_query_5 = table.records_intersecting(
-    #     projected_containing_polygon, crs=CRS.from_epsg(32618), geometry_fields=['field_2']
+    #     PROJECTED_CONTAINING_POLYGON, crs=CRS.from_epsg(32618), geometry_fields=['field_2']
     # )
 
-    with sqlite_connection() as connection:
-        cursor = connection.cursor()
-        cursor.execute(f"DROP TABLE {table_name};")
-
-    assert test_query_1 == records
-    assert test_query_2 == records
-    assert test_query_3 == records[:2]
-    assert test_query_4 == records[:2]
+    assert test_inserted_records == INTERSECTING_RECORDS
+    assert sorted_by_primary_key(test_query_1) == INTERSECTING_RECORDS
+    assert sorted_by_primary_key(test_query_2) == INTERSECTING_RECORDS
+    assert sorted_by_primary_key(test_query_3) == INTERSECTING_RECORDS[:2]
+    assert sorted_by_primary_key(test_query_4) == INTERSECTING_RECORDS[:2]
 
     # TODO fix SRID transformation from 32618
-    # assert test_query_5 == records[:2]
+    # assert test_query_5 == INTERSECTING_RECORDS[:2]